@@ -35,6 +35,8 @@ import os
 import sys
 import time
 import math
+import bisect
+import collections
 import traceback
 import inspect
 import re
@@ -47,7 +49,7 @@ import socketserver
 import logging.handlers
 import struct
 import pickle
-import select
+import selectors
 import socket
 
 import numpy as np
@@ -63,8 +65,8 @@ import scipy.fftpack
 import scipy.interpolate
 import pandas
 
-try: import pygit2
-except ImportError: pass
+try: import msgpack
+except ImportError: msgpack = None
 
 ## MODULES IMPORTS
 import orb.utils.spectrum, orb.utils.parallel, orb.utils.io, orb.utils.filters
@@ -72,6 +74,51 @@ import orb.cutils
 
 import orb.utils.photometry, orb.utils.validate
 
+# path to the ORB data folder
+_DATA_DIR = os.path.join(os.path.split(__file__)[0], "data")
+
+# paths of the data files keyed by file name
+_DATA_FILE_PATHS = dict()
+
+# paths already found in the data folder
+_EXISTING_DATA_PATHS = set()
+
+# parsed standard tables keyed by path
+_STANDARD_TABLES = dict()
+
+# sentinel of a missing value (None can be a valid value)
+_NOT_SET = object()
+
+# version string shown in the log records
+_BRANCH_NAME = os.environ.get(
+    'ORB_BRANCH_NAME', orb.version.__version__) + '|'
+
+# shared Lines instance (see _get_lines())
+_LINES = None
+
+def _data_path_exists(path):
+    """Return True if the given path points to an existing file. Only
+    found files are remembered, so that a missing file is checked
+    again on the next call.
+
+    :param path: Path to the file.
+    """
+    if path in _EXISTING_DATA_PATHS:
+        return True
+    if os.path.isfile(path):
+        _EXISTING_DATA_PATHS.add(path)
+        return True
+    return False
+
+def _get_lines():
+    """Return a Lines instance shared by all the callers which only
+    need the lines tables (created at the first call).
+    """
+    global _LINES
+    if _LINES is None:
+        _LINES = Lines()
+    return _LINES
+
 
 #################################################
 #### CLASS TextColor ############################
@@ -106,8 +153,19 @@ class ColorStreamHandler(logging.StreamHandler):
     DEBUG    = TextColor.CYAN
     DEFAULT  = TextColor.DEFAULT
 
+    # color of each level already met
+    _level_colors = dict()
+    
     @classmethod
     def _get_color(cls, level):
+        try:
+            return cls._level_colors[level]
+        except KeyError:
+            color = cls._level_colors[level] = cls._compute_color(level)
+            return color
+
+    @classmethod
+    def _compute_color(cls, level):
         if level >= logging.CRITICAL:  return cls.CRITICAL
         elif level >= logging.ERROR:   return cls.ERROR
         elif level >= logging.WARNING: return cls.WARNING
@@ -117,11 +175,18 @@ class ColorStreamHandler(logging.StreamHandler):
 
     def __init__(self, stream=None):
         super().__init__(stream)
+        # colors are only written to a terminal or a notebook
+        try:
+            self._colored = bool(self.stream.isatty())
+        except Exception:
+            self._colored = False
+        if type(self.stream).__module__.startswith('ipykernel'):
+            self._colored = True
 
     def format(self, record):
         text = logging.StreamHandler.format(self, record)
-        color = self._get_color(record.levelno)
-        return color + text + self.DEFAULT
+        if not self._colored: return text
+        return ''.join((self._get_color(record.levelno), text, self.DEFAULT))
 
 #################################################
 #### CLASS LoggingFilter ########################
@@ -144,6 +209,10 @@ class ExtDebugLoggingFilter(logging.Filter):
             if record.module in self.bad_names: return False
         return True
 
+# first byte of a msgpack map (fixmap with 1 to 15 elements, map16,
+# map32). A pickled dict never starts with one of these bytes.
+MSGPACK_MAP_HEADERS = frozenset(list(range(0x81, 0x90)) + [0xde, 0xdf])
+
 class LogRecordStreamHandler(socketserver.StreamRequestHandler):
     """Handler for a streaming logging request.
 
@@ -156,18 +225,47 @@ class LogRecordStreamHandler(socketserver.StreamRequestHandler):
         followed by the LogRecord in pickle format. Logs the record
         according to whatever policy is configured locally.
         """
-        #while True:
-        chunk = self.connection.recv(4)
-        if len(chunk) < 4: return
-        slen = struct.unpack('>L', chunk)[0]
-        chunk = self.connection.recv(slen)
-        while len(chunk) < slen:
-            chunk = chunk + self.connection.recv(slen - len(chunk))
-        obj = self.unPickle(chunk)
-        record = logging.makeLogRecord(obj)
-        self.handleLogRecord(record)
+        # records are read until the client closes the connection
+        while True:
+            chunk = self._recv_exactly(4)
+            if chunk is None: return
+            slen = struct.unpack('>L', chunk)[0]
+            chunk = self._recv_exactly(slen)
+            if chunk is None: return
+            obj = self.unPickle(chunk)
+            record = logging.makeLogRecord(obj)
+            self.handleLogRecord(record)
+
+    def _recv_exactly(self, size):
+        """Receive exactly size bytes in a preallocated buffer. Return
+        None if the connection is closed before.
+
+        Bytes are read through the buffered socket file so that
+        small records sent together are received with one system
+        call.
+
+        :param size: Number of bytes to receive.
+        """
+        buf = bytearray(size)
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            nbytes = self.rfile.readinto(view[pos:])
+            if not nbytes: return None
+            pos += nbytes
+        return buf
 
     def unPickle(self, data):
+        """Deserialize a log record.
+
+        Records packed with msgpack (sent by
+        :py:class:`orb.utils.log.MsgpackSocketHandler`) are
+        recognized by their first byte (msgpack map header). Other
+        records are considered pickled (sent by a standard
+        :py:class:`logging.handlers.SocketHandler`).
+        """
+        if msgpack is not None and data[0] in MSGPACK_MAP_HEADERS:
+            return msgpack.unpackb(data, raw=False)
         return pickle.loads(data)
 
     def handleLogRecord(self, record):
@@ -184,27 +282,39 @@ class LogRecordSocketReceiver(socketserver.ThreadingTCPServer):
     """
     Simple TCP socket-based logging receiver suitable for testing.
     """
+    # connections are kept open by the clients, their threads must
+    # not prevent the program from exiting
+    daemon_threads = True
+    
     def __init__(self, host='localhost',
                  port=logging.handlers.DEFAULT_TCP_LOGGING_PORT,
                  handler=LogRecordStreamHandler):
         super().__init__((host, port), handler)
         self.abort = False
-        self.timeout = True
-
+        # select returns at least every timeout seconds to check abort
+        self.timeout = 0.5
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.socket.fileno(), selectors.EVENT_READ)
+
+    # size of the receive buffer, large enough to absorb a burst of
+    # debug records
+    rcvbuf_size = 1 << 20
+    
     def server_bind(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # set before listen so that accepted connections inherit it
+        self.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
         self.socket.bind(self.server_address)
 
     def serve_until_stopped(self):
         abort = False
         try:
             while not abort:
-                rd, wr, ex = select.select([self.socket.fileno()],
-                                           [], [], self.timeout)
-                if rd:
+                # select blocks until a request comes or timeout
+                if self._selector.select(self.timeout):
                     self.handle_request()
                 abort = self.abort
-                time.sleep(0.001)
                 
         except Exception:
             pass
@@ -237,7 +347,12 @@ class Logger(object):
         else:
             self.level = logging.INFO
 
-        self.branch_name = orb.version.__version__ + '|'
+        self.branch_name = _BRANCH_NAME
+        # formats and formatters are only created once
+        self._logformat = '%(asctime)s|%(module)s:%(lineno)s:%(funcName)s|{}%(levelname)s> %(message)s'.format(self.branch_name)
+        self._simplelogformat = '{}%(levelname)s| %(message)s'.format(
+            self.branch_name)
+        self._formatters = dict()
         
         self.start_logging()
         
@@ -262,8 +377,10 @@ class Logger(object):
 
         # clear old logging state
         self.root = self.getLogger()
-        [self.root.removeHandler(ihand) for ihand in self.root.handlers[:]]
-        [self.root.removeFilter(ihand) for ifilt in self.root.filters[:]]
+        for ihand in list(self.root.handlers):
+            self.root.removeHandler(ihand)
+        for ifilt in list(self.root.filters):
+            self.root.removeFilter(ifilt)
 
         # init logging
         self.root.setLevel(self.level)
@@ -272,9 +389,7 @@ class Logger(object):
         ch.setLevel(self.level)
             
         if self.debug:
-            formatter = logging.Formatter(
-                self.get_logformat(),
-                self.get_logdateformat())
+            formatter = self._get_formatter()
 
             # print warning traceback
             _formatwarning = warnings.formatwarning
@@ -286,9 +401,7 @@ class Logger(object):
             warnings.formatwarning = formatwarning_tb
         
         else:
-            formatter = logging.Formatter(
-                self.get_simplelogformat(),
-                self.get_logdateformat())
+            formatter = self._get_formatter(simple=True)
         ch.setFormatter(formatter)
         ch.addFilter(self.get_logfilter(logfilter))
         self.root.addHandler(ch)
@@ -335,37 +448,45 @@ class Logger(object):
             ch = logging.StreamHandler(
                 open(self._get_logfile_path(), 'a'))
             ch.setLevel(self.level)
-            formatter = logging.Formatter(
-                self.get_logformat(),
-                self.get_logdateformat())
-            ch.setFormatter(formatter)
+            ch.setFormatter(self._get_formatter())
             ch.addFilter(self.get_logfilter(logfilter))
             self.root.addHandler(ch)
 
     def get_logging_state(self):
         """Return True if the logging is set"""
-        _len = len(self.getLogger().handlers)
-        if _len == 0: return False
-        elif _len < 3: return True
-        else:
-            raise Exception('Logging in strange state: {}'.format(self.getLogger().handlers))
+        handlers = self.getLogger().handlers
+        if __debug__ and len(handlers) > 2:
+            raise Exception('Logging in strange state: {}'.format(handlers))
+        return len(handlers) > 0
 
     def get_file_logging_state(self):
         """Return True if the file logging appears set"""
-        _len = len(self.getLogger().handlers)
-        if _len < 2: return False
-        elif _len == 2: return True
-        else:
-            raise Exception('File Logging in strange state: {}'.format(self.getLogger().handlers))
+        handlers = self.getLogger().handlers
+        if __debug__ and len(handlers) > 2:
+            raise Exception('File Logging in strange state: {}'.format(handlers))
+        return len(handlers) == 2
         
         
     def get_logformat(self):
         """Return a string describing the logging format"""        
-        return '%(asctime)s|%(module)s:%(lineno)s:%(funcName)s|{}%(levelname)s> %(message)s'.format(self.branch_name)
+        return self._logformat
 
     def get_simplelogformat(self):
         """Return a string describing the simple logging format"""
-        return '{}%(levelname)s| %(message)s'.format(self.branch_name)
+        return self._simplelogformat
+
+    def _get_formatter(self, simple=False):
+        """Return a logging formatter. Formatters are created once.
+
+        :param simple: (Optional) If True the simple logging format
+          is used (default False).
+        """
+        if simple not in self._formatters:
+            if simple: logformat = self.get_simplelogformat()
+            else: logformat = self.get_logformat()
+            self._formatters[simple] = logging.Formatter(
+                logformat, self.get_logdateformat())
+        return self._formatters[simple]
 
 
     def get_logdateformat(self):
@@ -403,6 +524,10 @@ class Params(dict):
     """Special dictionary which elements can be accessed like
     attributes.
     """
+    # no instance __dict__: attributes are the dictionary items, an
+    # attribute lookup goes directly to __getattr__
+    __slots__ = ()
+    
     __getattr__ = dict.__getitem__
     __delattr__ = dict.__delitem__
     __setattr__ = dict.__setitem__
@@ -419,9 +544,7 @@ class Params(dict):
 
     def convert(self):
         """Convert to a nice pickable object"""
-        conv = dict()
-        conv.update(self)
-        return conv
+        return dict(self)
 
     def save(self, path):
         """Try to save data in an HDF5 format.
@@ -457,6 +580,8 @@ class ROParams(Params):
 
     Attributes are read-only and may be defined only once.
     """
+    __slots__ = ()
+    
     def __setattr__(self, key, value):
         """Special set attribute function. Always raise a read-only
         error.
@@ -475,11 +600,12 @@ class ROParams(Params):
 
         :param value: Item value.
         """
-        if key in self:
+        old_value = dict.get(self, key, _NOT_SET)
+        if old_value is not _NOT_SET:
             try:
-                if not np.all(np.isclose(self[key] - value, 0.)):
+                if not np.all(np.isclose(old_value - value, 0.)):
                     logging.debug('Parameter {} already defined'.format(key))
-                    logging.debug('Old value={} / new_value={}'.format(self[key], value))
+                    logging.debug('Old value={} / new_value={}'.format(old_value, value))
             except TypeError: pass
             except ValueError: pass
                 
@@ -498,6 +624,8 @@ class NoInstrumentConfigParams(ROParams):
 
     Attributes are read-only and may be defined only once.
     """
+    __slots__ = ()
+    
     def __getitem__(self, key):
         if key not in self:
             raise AttributeError("Instrument configuration not loaded. Set the option 'instrument' to a valid instrument name")
@@ -516,6 +644,91 @@ class Tools(object):
     """
     instruments = ['sitelle', 'spiomm']
     filters = ['SN1', 'SN2', 'SN3', 'C1', 'C2', 'C3', 'C4', 'FULL', 'PS1_r', 'PS1_i', 'PS1_g', 'PS1_y', 'PS1_z', 'F656N', 'SPIOMM_CALIB']
+
+    # parsed config files keyed by path
+    _config_files = dict()
+
+    # full names of the tuning parameters keyed by (class, caller
+    # code, parameter name)
+    _tuning_parameter_names = dict()
+
+    # headers of the created files keyed by (class, data prefix)
+    _data_path_hdrs = dict()
+
+    # (key, cast) of the parameters loaded from the config file
+    minimal_config_params = (
+        ('DIV_NB', int),
+        ('BIG_DATA', bool),
+        ('DETECT_STAR_NB', int),
+        ('INIT_FWHM', float),
+        ('PSF_PROFILE', str),
+        ('MOFFAT_BETA', float),
+        ('DETECT_STACK', int),
+        ('ALIGNER_RANGE_COEFF', float),
+        ('BOX_SIZE_COEFF', float),
+    )
+
+    instrument_config_params = (
+        ('OBSERVATORY_NAME', str),
+        ('TELESCOPE_NAME', str),
+        ('INSTRUMENT_NAME', str),
+
+        ('OBS_LAT', float),
+        ('OBS_LON', float),
+        ('OBS_ALT', float),
+
+        ('ATM_EXTINCTION_FILE', str),
+        ('MIR_TRANSMISSION_FILE', str),
+        ('MIR_SURFACE', float),
+
+        ('FIELD_OF_VIEW_1', float),
+        ('FIELD_OF_VIEW_2', float),
+
+        ('PIX_SIZE_CAM1', float),
+        ('PIX_SIZE_CAM2', float),
+
+        ('BALANCED_CAM', int),
+
+        ('CAM1_DETECTOR_SIZE_X', int),
+        ('CAM1_DETECTOR_SIZE_Y', int),
+        ('CAM2_DETECTOR_SIZE_X', int),
+        ('CAM2_DETECTOR_SIZE_Y', int),
+
+        ('CAM1_GAIN', float),
+        ('CAM2_GAIN', float),
+        ('CAM1_QE_FILE', str),
+        ('CAM2_QE_FILE', str),
+
+        ('OFF_AXIS_ANGLE_MIN', float),
+        ('OFF_AXIS_ANGLE_MAX', float),
+        ('OFF_AXIS_ANGLE_CENTER', float),
+
+        ('INIT_ANGLE', float),
+        ('INIT_DX', float),
+        ('INIT_DY', float),
+        ('CALIB_NM_LASER', float),
+        ('CALIB_ORDER', int),
+        ('CALIB_STEP_SIZE', float),
+        ('PHASE_FIT_DEG', int),
+        ('PHASE_BINNING', int),
+
+        ('NCPUS', int),
+        ('OPTIM_DARK_CAM1', bool),
+        ('OPTIM_DARK_CAM2', bool),
+        ('EXT_ILLUMINATION', bool),
+
+        ('SATURATION_THRESHOLD', float),
+        ('WCS_ROTATION', float),
+
+        ('OPD_JITTER', float),
+        ('WF_ERROR', float),
+        ('4RT_FILE', str),
+
+        # optional parameters
+        ('BIAS_CALIB_PARAM_A', float),
+        ('BIAS_CALIB_PARAM_B', float),
+        ('DARK_ACTIVATION_ENERGY', float),
+    )
                 
     def __init__(self, instrument=None, config=None,
                  data_prefix="./temp/data."):
@@ -545,82 +758,14 @@ class Tools(object):
         
         # loading minimal config
         self.instrument = instrument
-        self.set_config('DIV_NB', int)
-        self.set_config('BIG_DATA', bool)
-        self.set_config('DETECT_STAR_NB', int)
-        self.set_config('INIT_FWHM', float)
-        self.set_config('PSF_PROFILE', str)
-        self.set_config('MOFFAT_BETA', float)
-        self.set_config('DETECT_STACK', int)
-        self.set_config('ALIGNER_RANGE_COEFF', float)
-        self.set_config('ALIGNER_RANGE_COEFF', float)
-        self.set_config('BOX_SIZE_COEFF', float)
+        self._config_raw = None # config file content (read once)
+        for key, cast in self.minimal_config_params:
+            self.set_config(key, cast)
             
         if self.instrument is not None:
             # load instrument configuration
-            self.set_config('OBSERVATORY_NAME', str)
-            self.set_config('TELESCOPE_NAME', str)
-            self.set_config('INSTRUMENT_NAME', str)
-
-            self.set_config('OBS_LAT', float)
-            self.set_config('OBS_LON', float)
-            self.set_config('OBS_ALT', float)
-            
-            self.set_config('ATM_EXTINCTION_FILE', str)
-            self.set_config('MIR_TRANSMISSION_FILE', str)
-            self.set_config('MIR_SURFACE', float)
-            
-            self.set_config('FIELD_OF_VIEW_1', float)
-            self.set_config('FIELD_OF_VIEW_2', float)
-            
-            self.set_config('PIX_SIZE_CAM1', float)
-            self.set_config('PIX_SIZE_CAM2', float)
-
-            self.set_config('BALANCED_CAM', int)
-
-            self.set_config('CAM1_DETECTOR_SIZE_X', int)
-            self.set_config('CAM1_DETECTOR_SIZE_Y', int)
-            self.set_config('CAM2_DETECTOR_SIZE_X', int)
-            self.set_config('CAM2_DETECTOR_SIZE_Y', int)
-
-            self.set_config('CAM1_GAIN', float)
-            self.set_config('CAM2_GAIN', float)
-            self.set_config('CAM1_QE_FILE', str)
-            self.set_config('CAM2_QE_FILE', str)
-        
-            self.set_config('OFF_AXIS_ANGLE_MIN', float)
-            self.set_config('OFF_AXIS_ANGLE_MAX', float)
-            self.set_config('OFF_AXIS_ANGLE_CENTER', float)
-
-            self.set_config('INIT_ANGLE', float)
-            self.set_config('INIT_DX', float)
-            self.set_config('INIT_DY', float)
-            self.set_config('CALIB_NM_LASER', float)
-            self.set_config('CALIB_ORDER', int)
-            self.set_config('CALIB_STEP_SIZE', float)
-            self.set_config('PHASE_FIT_DEG', int)
-            self.set_config('PHASE_BINNING', int)
-
-            self.set_config('NCPUS', int)
-            self.set_config('DIV_NB', int)
-            self.set_config('BIG_DATA', bool)
-            self.set_config('OPTIM_DARK_CAM1', bool) 
-            self.set_config('OPTIM_DARK_CAM2', bool)
-            self.set_config('EXT_ILLUMINATION', bool)
-
-            self.set_config('SATURATION_THRESHOLD', float)
-            self.set_config('WCS_ROTATION', float)
-            
-            self.set_config('OPD_JITTER', float)
-            self.set_config('WF_ERROR', float)
-            self.set_config('4RT_FILE', str)
-
-            
-            # optional parameters
-            self.set_config('BIAS_CALIB_PARAM_A', float)
-            self.set_config('BIAS_CALIB_PARAM_B', float)
-            self.set_config('DARK_ACTIVATION_ENERGY', float)
-            
+            for key, cast in self.instrument_config_params:
+                self.set_config(key, cast)
 
         self._data_prefix = data_prefix
         self._data_path_hdr = self._get_data_path_hdr()
@@ -659,14 +804,25 @@ class Tools(object):
             
     def _get_data_path_hdr(self):
         """Return the header of the created files."""
-        return self._data_prefix + self.__class__.__name__ + "."
+        key = (self.__class__, self._data_prefix)
+        try:
+            return self._data_path_hdrs[key]
+        except KeyError:
+            hdr = self._data_prefix + self.__class__.__name__ + "."
+            self._data_path_hdrs[key] = hdr
+            return hdr
 
     def _get_orb_data_file_path(self, file_name):
         """Return the path to a file in ORB data folder: orb/data/file_name
 
         :param file_name: Name of the file in ORB data folder.
         """
-        return os.path.join(os.path.split(__file__)[0], "data", file_name)
+        try:
+            return _DATA_FILE_PATHS[file_name]
+        except KeyError:
+            path = _DATA_FILE_PATHS[file_name] = os.path.join(
+                _DATA_DIR, file_name)
+            return path
         
     def _get_date_str(self):
         """Return local date and hour as a short string 
@@ -685,7 +841,7 @@ class Tools(object):
             raise Exception('No instrument configuration given')
         config_file_path = self._get_orb_data_file_path(
             self.config_file_name)
-        if not os.path.exists(config_file_path):
+        if not _data_path_exists(config_file_path):
              raise Exception(
                  "Configuration file %s does not exist !"%config_file_path)
         return config_file_path
@@ -713,7 +869,7 @@ class Tools(object):
         filter_name = self._parse_filter_name(filter_name)
         filter_file_path =  self._get_orb_data_file_path(
             "filter_" + filter_name + ".hdf5")
-        if not os.path.exists(filter_file_path):
+        if not _data_path_exists(filter_file_path):
              logging.warning(
                  "Filter file %s does not exist !"%filter_file_path)
              return None
@@ -734,7 +890,7 @@ class Tools(object):
         phase_file_path =  self._get_orb_data_file_path(
             "phase_" + filter_name + ".old.hdf5")
         
-        if not os.path.exists(phase_file_path):
+        if not _data_path_exists(phase_file_path):
              logging.warning(
                  "Phase file %s does not exist !"%phase_file_path)
              return None
@@ -754,7 +910,7 @@ class Tools(object):
         phase_file_path =  self._get_orb_data_file_path(
             "phase_" + filter_name + ".hdf5")
         
-        if not os.path.exists(phase_file_path):
+        if not _data_path_exists(phase_file_path):
              logging.warning(
                  "Phase file %s does not exist !"%phase_file_path)
              return None
@@ -780,7 +936,7 @@ class Tools(object):
         sip_file_path =  self._get_orb_data_file_path(
             "sip." + cam_name + ".fits")
         
-        if not os.path.exists(sip_file_path):
+        if not _data_path_exists(sip_file_path):
              logging.warning(
                  "SIP file %s does not exist !"%sip_file_path)
              return None
@@ -800,7 +956,7 @@ class Tools(object):
         filter_name = self._parse_filter_name(filter_name)
         optics_file_path =  self._get_orb_data_file_path(
             "optics_" + filter_name + ".hdf5")
-        if not os.path.exists(optics_file_path):
+        if not _data_path_exists(optics_file_path):
              logging.warning(
                  "Optics file %s does not exist !"%optics_file_path)
              return None
@@ -815,12 +971,62 @@ class Tools(object):
         """
         standard_table_path = self._get_orb_data_file_path(
             standard_table_name)
-        if not os.path.exists(standard_table_path):
+        if not _data_path_exists(standard_table_path):
              raise Exception(
                  "Standard table %s does not exist !"%standard_table_path)
         return standard_table_path
 
 
+    def _load_standard_table(self, standard_table_name):
+        """Parse the standard table and return a dict of its entries
+        keyed by standard name.
+
+        A standard can be recorded in more than one group, each name
+        is thus associated with the list of its entries, in the order
+        of the table. Each entry is a tuple (group, file name,
+        coordinates) where coordinates is the tuple of the recorded
+        RA, DEC and proper motion, kept as strings (it can be
+        empty). The table is parsed only once.
+
+        :param standard_table_name: Name of the standard table file
+        """
+        standard_table_path = self._get_standard_table_path(
+            standard_table_name=standard_table_name)
+        if standard_table_path in _STANDARD_TABLES:
+            return _STANDARD_TABLES[standard_table_path]
+        
+        std_table = dict()
+        with orb.utils.io.open_file(standard_table_path, 'r') as f:
+            lines = f.read().splitlines()
+            
+        for iline in lines:
+            iline = iline.split()
+            if len(iline) >= 3:
+                std_table.setdefault(iline[0], list()).append(
+                    (iline[1], iline[2], tuple(iline[3:7])))
+                    
+        _STANDARD_TABLES[standard_table_path] = std_table
+        return std_table
+
+    def _get_standard_entry(self, standard_name, standard_table_name):
+        """Return the entries of the standard table matching a standard
+        name. The entries of the exact name are returned first, then
+        the entries of every recorded name contained in the given
+        name.
+
+        :param standard_name: Name of the standard star.
+
+        :param standard_table_name: Name of the standard table file
+        """
+        std_table = self._load_standard_table(standard_table_name)
+        if standard_name in std_table:
+            for ientry in std_table[standard_name]:
+                yield ientry
+        for iname in std_table:
+            if iname != standard_name and iname in standard_name:
+                for ientry in std_table[iname]:
+                    yield ientry
+    
     def _get_standard_list(self, standard_table_name='std_table.orb',
                            group=None):
         """Return the list of standards recorded in the standard table
@@ -831,19 +1037,10 @@ class Tools(object):
         groups = ['MASSEY', 'MISC', 'CALSPEC', 'OKE', None]
         if group not in groups:
             raise Exception('Group must be in %s'%str(groups))
-        std_table = orb.utils.io.open_file(self._get_standard_table_path(
-            standard_table_name=standard_table_name), 'r')
-        std_list = list()
-        for iline in std_table:
-            iline = iline.split()
-            if len(iline) == 3:
-                if group is None:
-                    std_list.append(iline[0])
-                elif iline[1] == group:
-                    std_list.append(iline[0])
-                    
-        std_list.sort()
-        return std_list
+        std_table = self._load_standard_table(standard_table_name)
+        return sorted(iname for iname in std_table
+                      if group is None
+                      or group in [ientry[0] for ientry in std_table[iname]])
     
     def _get_standard_file_path(self, standard_name,
                                 standard_table_name='std_table.orb'):
@@ -859,16 +1056,11 @@ class Tools(object):
         :return: A tuple [standard file path, standard type]. Standard type
           can be 'MASSEY', 'CALSPEC', 'MISC' or 'OKE'.
         """
-        std_table = orb.utils.io.open_file(self._get_standard_table_path(
-            standard_table_name=standard_table_name), 'r')
-
-        for iline in std_table:
-            iline = iline.split()
-            if len(iline) >= 3:
-                if iline[0] in standard_name:
-                    file_path = self._get_orb_data_file_path(iline[2])
-                    if os.path.exists(file_path):
-                        return file_path, iline[1]
+        for igroup, file_name, _ in self._get_standard_entry(
+                standard_name, standard_table_name):
+            file_path = self._get_orb_data_file_path(file_name)
+            if _data_path_exists(file_path):
+                return file_path, igroup
 
         raise Exception('Standard name unknown. Please see data/std_table.orb for the list of recorded standard spectra')
 
@@ -898,29 +1090,22 @@ class Tools(object):
             logging.info('Standard name resolved with SESAME.')
             return coords
             
-        std_table = orb.utils.io.open_file(self._get_standard_table_path(
-            standard_table_name=standard_table_name), 'r')
-
-        for iline in std_table:
-            iline = iline.strip().split()
-            if len(iline) >= 3:
-                if iline[0] in standard_name:
-                    if len(iline) > 3:
-                        ra = float(iline[3])
-                        dec = float(iline[4])
-                        if len(iline) > 5:
-                            pm_ra = float(iline[5])
-                            pm_dec = float(iline[6])
-                        else:
-                            pm_ra = 0.
-                            pm_dec = 0.
-                        if return_pm:
-                            return ra, dec, pm_ra, pm_dec
-                        else:
-                            return ra, dec
-                    else:
-                        raise Exception('No RA DEC recorded for standard: {}'.format(
-                            standard_name))
+        for _, _, coords in self._get_standard_entry(
+                standard_name, standard_table_name):
+            if len(coords) > 0:
+                ra, dec = float(coords[0]), float(coords[1])
+                if len(coords) > 2:
+                    pm_ra, pm_dec = float(coords[2]), float(coords[3])
+                else:
+                    pm_ra = 0.
+                    pm_dec = 0.
+                if return_pm:
+                    return ra, dec, pm_ra, pm_dec
+                else:
+                    return ra, dec
+            else:
+                raise Exception('No RA DEC recorded for standard: {}'.format(
+                    standard_name))
                     
 
         raise Exception('Standard name unknown. Please see data/std_table.orb for the list of recorded standard spectra')
@@ -976,11 +1161,11 @@ class Tools(object):
              PIX_SIZE_CAM1 20 # Size of one pixel of the camera 1 in um
              PIX_SIZE_CAM2 15 # Size of one pixel of the camera 2 in um  
         """
-        with orb.utils.io.open_file(self._get_config_file_path(), 'r') as f:
-            for line in f:
-                if len(line) > 2:
-                    if line.split()[0] == param_key:
-                        return line.split()[1]
+        if getattr(self, '_config_raw', None) is None:
+            self._config_raw = self._load_config_file()
+        if param_key in self._config_raw:
+            return self._config_raw[param_key]
+        
         if not optional:
             raise Exception("Parameter key %s not found in file %s"%(
                 param_key, self.config_file_name))
@@ -989,6 +1174,34 @@ class Tools(object):
                 param_key, self.config_file_name))
             return None
 
+    def _load_config_file(self):
+        """Read the config file and return a dict of all the
+        parameters (as strings) keyed by parameter key.
+
+        See :py:meth:`_get_config_parameter` for the file format. If
+        a key appears more than once, the first value is kept.
+
+        A config file is only parsed once, the result is shared by
+        all the instances.
+        """
+        config_file_path = self._get_config_file_path()
+        if config_file_path in self._config_files:
+            return self._config_files[config_file_path]
+        
+        config_raw = dict()
+        with orb.utils.io.open_file(config_file_path, 'r') as f:
+            lines = f.read().splitlines()
+            
+        for line in lines:
+            if len(line) > 2:
+                # only the first two words are read
+                words = line.split(None, 2)
+                if len(words) > 1 and words[0] not in config_raw:
+                    config_raw[words[0]] = words[1]
+                    
+        self._config_files[config_file_path] = config_raw
+        return config_raw
+
     def _get_ncpus(self):
         """Return the number of CPUS available
         """
@@ -1036,20 +1249,23 @@ class Tools(object):
 
         :param default_value: Default value.
         """
-        caller_name = (self.__class__.__name__ + '.'
-                       + sys._getframe(1).f_code.co_name)
-        full_parameter_name = caller_name + '.' + parameter_name
+        key = (self.__class__, sys._getframe(1).f_code, parameter_name)
+        try:
+            full_parameter_name = self._tuning_parameter_names[key]
+        except KeyError:
+            full_parameter_name = '.'.join((
+                self.__class__.__name__, key[1].co_name, parameter_name))
+            self._tuning_parameter_names[key] = full_parameter_name
         logging.info('looking for tuning parameter: {}'.format(
             full_parameter_name))
-        if full_parameter_name in self.config:
-            logging.warning(
-                'Tuning parameter {} changed to {} (default {})'.format(
-                    full_parameter_name,
-                    self.config[full_parameter_name],
-                    default_value))
-            return self.config[full_parameter_name]
-        else:
+        value = dict.get(self.config, full_parameter_name, _NOT_SET)
+        if value is _NOT_SET:
             return default_value
+        
+        logging.warning(
+            'Tuning parameter {} changed to {} (default {})'.format(
+                full_parameter_name, value, default_value))
+        return value
                 
     def save_sip(self, fits_path, hdr, overwrite=True):
         """Save SIP parameters from a header to a blanck FITS file.
@@ -1059,8 +1275,7 @@ class Tools(object):
         :param overwrite: (Optional) Overwrite the FITS file.
         """    
         clean_hdr = self._clean_sip(hdr)
-        data = np.empty((1,1))
-        data.fill(np.nan)
+        data = np.full((1,1), np.nan, dtype=np.float32)
         orb.utils.io.write_fits(
             fits_path, data, fits_header=clean_hdr, overwrite=overwrite)
 
@@ -1100,6 +1315,7 @@ class ProgressBar(object):
     REFRESH_COUNT = 3 # number of steps used to calculate a remaining time
     MAX_CARAC = 78 # Maximum number of characters in a line
     BAR_LENGTH = 10. # Length of the bar
+    MIN_REFRESH_TIME = 0.1 # Minimum time between two redraws (in s)
 
     def __init__(self, max_index, silent=False):
         """Initialize ProgressBar class
@@ -1112,16 +1328,22 @@ class ProgressBar(object):
         """
         self._start_time = time.time()
         self._max_index = float(max_index)
-        self._time_table = np.zeros((self.REFRESH_COUNT), float)
-        self._index_table = np.zeros((self.REFRESH_COUNT), float)
+        # the last REFRESH_COUNT update times and indexes
+        self._time_table = collections.deque(
+            [0.] * self.REFRESH_COUNT, maxlen=self.REFRESH_COUNT)
+        self._index_table = collections.deque(
+            [0.] * self.REFRESH_COUNT, maxlen=self.REFRESH_COUNT)
         self._silent = silent
         self._count = 0
+        self._last_update_time = 0.
+        self._last_line = '' # last line written on the terminal
         
     def _erase_line(self):
         """Erase the progress bar"""
         if not self._silent:
             sys.stdout.write("\r" + " " * self.MAX_CARAC)
             sys.stdout.flush()
+            self._last_line = ''
 
     def _time_str_convert(self, sec):
         """Convert a number of seconds in a human readable string
@@ -1136,15 +1358,12 @@ class ProgressBar(object):
             return '{:.2f} s'.format(sec)
         elif (sec < 60.):
             return '{:.1f} s'.format(sec)
-        elif (sec < 3600.):
-            minutes = int(math.floor(sec/60.))
-            seconds = int(sec - (minutes * 60.))
-            return str(minutes) + "m" + str(seconds) + "s"
+        minutes, seconds = divmod(int(sec), 60)
+        if (sec < 3600.):
+            return '{}m{}s'.format(minutes, seconds)
         else:
-            hours = int(math.floor(sec/3600.))
-            minutes = int(math.floor((sec - (hours*3600.))/60.))
-            seconds = int(sec - (hours * 3600.) - (minutes * 60.))
-            return str(hours) + "h" + str(minutes) + "m" + str(seconds) + "s"
+            hours, minutes = divmod(minutes, 60)
+            return '{}h{}m{}s'.format(hours, minutes, seconds)
 
     
     def update(self, index, info="", remains=True, nolog=True):
@@ -1161,15 +1380,24 @@ class ProgressBar(object):
 
         :param nolog: (Optional) No logging of the printed text is
           made (default True).
+
+        .. note:: To avoid too many writes on the terminal, the
+          progress bar is not updated if the last update is more
+          recent than MIN_REFRESH_TIME, unless the task is completed.
         """
+        if self._silent: return
+        
+        now = time.time()
+        if (index < self._max_index
+            and now - self._last_update_time < self.MIN_REFRESH_TIME):
+            return
+        self._last_update_time = now
+        
         if (self._max_index > 0):
             color = TextColor.CYAN
             self._count += 1
-            for _icount in range(self.REFRESH_COUNT - 1):
-                self._time_table[_icount] = self._time_table[_icount + 1]
-                self._index_table[_icount] = self._index_table[_icount + 1]
-            self._time_table[-1] = time.time()
-            self._index_table[-1] = index
+            self._time_table.append(now)
+            self._index_table.append(index)
             index_by_step = ((self._index_table[-1] - self._index_table[0])
                              /float(self.REFRESH_COUNT - 1))
                 
@@ -1202,13 +1430,17 @@ class ProgressBar(object):
             line = ("\r [please wait] [" +
                     str(info) +"]")
             
-        self._erase_line()
         if (len(line) > self.MAX_CARAC):
             rem_len = len(line) - self.MAX_CARAC + 1
             line = line[:-rem_len]
-        if not self._silent:
-            sys.stdout.write(line)
-            sys.stdout.flush()
+            
+        # nothing is written if the displayed line does not change
+        if line == self._last_line: return
+        
+        # the new line is padded to overwrite the end of the last one
+        sys.stdout.write(line + " " * (len(self._last_line) - len(line)))
+        sys.stdout.flush()
+        self._last_line = line
 
     def end(self, silent=False):
         """End the progress bar and display the total time needed to
@@ -1248,19 +1480,27 @@ class Indexer(Tools):
     All files locations are stored in a text-like file: the index
     file. This file is the 'real' counterpart of the index (which is
     'virtual' until :py:meth:`core.Indexer.update_index` is
-    called). This method is called each time
-    :py:meth:`core.Indexer.__setitem__` is called.
+    called). Each time :py:meth:`core.Indexer.__setitem__` is called
+    the new entry is appended to the index file (the whole index is
+    written the first time).
 
     This class can be accessed like a dictionary.
     """
+    # read-only, shared by all the instances
+    file_groups = ('cam1', 'cam2', 'merged')
+    file_group_indexes = (0, 1, 2)
+
+    # first two words (key and path) of each line of the index file
+    _index_line_re = re.compile(r'^[^\S\n]*(\S+)[^\S\n]+(\S+)', re.MULTILINE)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        self.file_groups = ['cam1', 'cam2', 'merged']
-        self.file_group_indexes = [0, 1, 2]
+        # the index state is specific to each instance
         self.index = dict()
         self.file_group = None
+        # True when the index file holds the whole virtual index
+        self._index_synced = False
 
     def __getitem__(self, file_key):
         """Implement the evaluation of self[file_key]
@@ -1284,7 +1524,12 @@ class Indexer(Tools):
         if self.file_group is not None:
             file_key = self.file_group + '.' + file_key
         self.index[file_key] = file_path
-        self.update_index()
+        if self._index_synced:
+            # the last entry of a key wins when the index is loaded
+            with orb.utils.io.open_file(self._get_index_path(), 'a') as f:
+                f.write('%s %s\n'%(file_key, str(file_path)))
+        else:
+            self.update_index()
 
     def __str__(self):
         """Implement the evaluation of str(self)"""
@@ -1359,12 +1604,10 @@ class Indexer(Tools):
         """Load index file and rebuild index of already located files"""
         self.index = dict()
         if os.path.exists(self._get_index_path()):
-            f = orb.utils.io.open_file(self._get_index_path(), 'r')
-            for iline in f:
-                if len(iline) > 2:
-                    iline = iline.split()
-                    self.index[iline[0]] = iline[1]
-            f.close()
+            with orb.utils.io.open_file(self._get_index_path(), 'r') as f:
+                # the last entry of a key is kept
+                self.index = dict(self._index_line_re.findall(f.read()))
+            self._index_synced = True
 
     def update_index(self):
         """Update index files with data in the virtual index"""
@@ -1372,6 +1615,7 @@ class Indexer(Tools):
         for ikey in self.index:
             f.write('%s %s\n'%(ikey, str(self.index[ikey])))
         f.close()
+        self._index_synced = True
         
         
 
@@ -1412,6 +1656,9 @@ class Lines(Tools):
     air_sky_lines_nm = None
     """Air sky lines wavelength"""
 
+    # parsed sky lines files keyed by path
+    _sky_lines_cache = dict()
+
     
     air_lines_nm = {
         'H15': 371.19774,
@@ -1470,37 +1717,68 @@ class Lines(Tools):
         :param kwargs: Kwargs are :py:class:`~core.Tools` properties.
         """
         super().__init__(**kwargs)
+        self._init_lines_names()
+        self._read_sky_file()
 
-        # create corresponding inverted dicts
-        self.air_lines_name = dict()
-        for ikey in self.air_lines_nm.keys():
-            self.air_lines_name[str(self.air_lines_nm[ikey])] = ikey
-
-        for ikey in self.other_names:
-            if ikey in self.air_lines_nm:
-                for iname in self.other_names[ikey]:
-                    self.air_lines_nm[iname] = float(self.air_lines_nm[ikey])
+    @classmethod
+    def _init_lines_names(cls):
+        """Create the inverted dict of the lines wavelength (keyed by
+        wavelength rounded to 1e-6 nm) and add the other names of the
+        lines. Done only once.
+        """
+        if Lines.air_lines_name is not None: return
+        
+        # built before the other names are added so that a wavelength
+        # is always converted to the main name of the line
+        air_lines_name = {round(inm, 6): ikey
+                          for ikey, inm in Lines.air_lines_nm.items()}
+
+        for ikey in Lines.other_names:
+            if ikey in Lines.air_lines_nm:
+                for iname in Lines.other_names[ikey]:
+                    Lines.air_lines_nm[iname] = float(Lines.air_lines_nm[ikey])
             else: raise ValueError('Bad key in self.other_names: {}'.format(ikey))
             
-        self._read_sky_file()
+        balmer_lines = sorted(
+            (Lines.air_lines_nm[iline], iline) for iline in (
+                'Halpha', 'Hbeta', 'Hgamma', 'Hdelta', 'Hepsilon'))
+        Lines._balmer_lines_nm = tuple(iline[0] for iline in balmer_lines)
+        Lines._balmer_lines_name = tuple(iline[1] for iline in balmer_lines)
+            
+        Lines.air_lines_name = air_lines_name
         
 
     def _read_sky_file(self):
         """Return sky file (sky_lines.orb) as a dict.
+
+        The file is only parsed once, the result is shared by all the
+        instances.
         """
         sky_lines_file_path = self._get_orb_data_file_path(
             self.sky_lines_file_name)
-        f = orb.utils.io.open_file(sky_lines_file_path, 'r')
-        self.air_sky_lines_nm = dict()
-        try:
-            for line in f:
-                if '#' not in line and len(line) > 2:
-                    line = line.split()
-                    self.air_sky_lines_nm[line[1]] = (float(line[1]) / 10., float(line[3]))
-        except Exception as e:
-            raise Exception('Error during parsing of {}: {}'.format(sky_lines_file_path, e))
-        finally:
-            f.close()
+        if sky_lines_file_path not in self._sky_lines_cache:
+            try:
+                # columns: wavelength in A (also used as the line
+                # name) and intensity
+                lines = np.atleast_2d(np.loadtxt(
+                    sky_lines_file_path, comments='#', usecols=(1, 3),
+                    dtype=str))
+                values = lines.astype(float)
+            except Exception as e:
+                raise Exception('Error during parsing of {}: {}'.format(sky_lines_file_path, e))
+            values[:,0] /= 10.
+            air_sky_lines_nm = {
+                iname: tuple(ivalues) for iname, ivalues in zip(
+                    lines[:,0].tolist(), values.tolist())}
+                
+            # names and (wavelength, intensity) array of the lines
+            self._sky_lines_cache[sky_lines_file_path] = (
+                air_sky_lines_nm, list(air_sky_lines_nm.keys()),
+                np.array(list(air_sky_lines_nm.values()),
+                         dtype=float).reshape((-1, 2)))
+            
+        (self.air_sky_lines_nm, self._sky_lines_name,
+         self._sky_lines) = self._sky_lines_cache[sky_lines_file_path]
 
     def get_sky_lines(self, nm_min, nm_max, delta_nm, line_nb=0,
                       get_names=False):
@@ -1519,83 +1797,60 @@ class Lines(Tools):
 
         :param get_name: (Optional) If True return lines name also.
         """
-        def merge(merged_lines):
-            
-            merged_lines_nm = np.array([line[1] for line in merged_lines])
-           
-            
-            merged_lines_nm = (np.sum(merged_lines_nm[:,0]
-                                      * merged_lines_nm[:,1])
-                               /np.sum(merged_lines_nm[:,1]),
-                               np.sum(merged_lines_nm[:,1]))
-
-            merged_lines_name = [line[0] for line in merged_lines]
-            temp_list = list()
-            
-            for name in merged_lines_name:
-                if 'MEAN' in name:
-                    name = name[5:-1]
-                temp_list.append(name)
-            merged_lines_name = 'MEAN[' + ','.join(temp_list) + ']'
-            return (merged_lines_name, merged_lines_nm)
-
-        lines = [(line_name, self.air_sky_lines_nm[line_name])
-                 for line_name in self.air_sky_lines_nm
-                 if (self.air_sky_lines_nm[line_name][0] >= nm_min
-                     and self.air_sky_lines_nm[line_name][0] <= nm_max)]
-        
-        lines.sort(key=lambda l: l[1][0])
-    
-        merged_lines = list()
-        final_lines = list()
-        
-        for iline in range(len(lines)):
-            if iline + 1 < len(lines):
-                if (abs(lines[iline][1][0] - lines[iline+1][1][0])
-                    < delta_nm / 2.):
-                    merged_lines.append(lines[iline])
-                else:
-                    if len(merged_lines) > 0:
-                        merged_lines.append(lines[iline])
-                        final_lines.append(merge(merged_lines))
-                        merged_lines = list()
-                    else:
-                        final_lines.append(lines[iline])
-                        
-        # correct a border effect if the last lines of the list are to
-        # be merged
-        if len(merged_lines) > 0:
-            merged_lines.append(lines[iline])
-            final_lines.append(merge(merged_lines))
-
-        lines = final_lines
+        lines_name = self._sky_lines_name
+        lines = self._sky_lines
         
+        # select lines in range, sorted by wavelength
+        isel = np.nonzero((lines[:,0] >= nm_min) & (lines[:,0] <= nm_max))[0]
+        isel = isel[np.argsort(lines[isel,0], kind='stable')]
+        nm = lines[isel,0]
+        intensity = lines[isel,1]
+    
+        # lines closer than half the resolution are merged: each group
+        # of consecutive lines starts where the gap is large enough
+        if nm.size > 0:
+            starts = np.concatenate(
+                ([0], np.flatnonzero(np.diff(nm) >= delta_nm / 2.) + 1))
+        else:
+            starts = np.zeros(0, dtype=int)
+        counts = np.diff(np.append(starts, nm.size))
+        
+        lines_nm = nm[starts]
+        lines_intensity = intensity[starts]
+        imerged = counts > 1
+        if np.any(imerged):
+            # merged lines: intensity-weighted mean wavelength and
+            # total intensity
+            sum_intensity = np.add.reduceat(intensity, starts)
+            lines_nm[imerged] = (np.add.reduceat(nm * intensity, starts)[imerged]
+                                 / sum_intensity[imerged])
+            lines_intensity = sum_intensity
+            
         # get only the most intense lines
+        igroups = np.arange(starts.size)
         if line_nb > 0:
-            lines.sort(key=lambda l: l[1][1], reverse=True)
-            lines = lines[:line_nb]
-
-        lines_nm = list(np.array([line[1] for line in lines])[:,0])
-        lines_name = [line[0] for line in lines]
-        
-        # add balmer lines
-        balmer_lines = ['Halpha', 'Hbeta', 'Hgamma', 'Hdelta', 'Hepsilon']
-        for iline in balmer_lines:
-            if (self.air_lines_nm[iline] >= nm_min
-                and self.air_lines_nm[iline] <= nm_max):
-                lines_nm.append(self.air_lines_nm[iline])
-                lines_name.append(iline)
-
+            igroups = np.argsort(-lines_intensity, kind='stable')[:line_nb]
+
+        # add balmer lines (sorted by wavelength)
+        imin = bisect.bisect_left(self._balmer_lines_nm, nm_min)
+        imax = bisect.bisect_right(self._balmer_lines_nm, nm_max)
+        balmer_lines = list(self._balmer_lines_name[imin:imax])
+        lines_nm = np.concatenate((
+            lines_nm[igroups], self._balmer_lines_nm[imin:imax]))
+
+        # all the lines are sorted once by wavelength
+        order = np.argsort(lines_nm, kind='stable')
+        lines_nm = lines_nm[order].tolist()
         if not get_names:
-            lines_nm.sort()
             return lines_nm
-        else:
-            lines = [(lines_name[iline], lines_nm[iline])
-                     for iline in range(len(lines_nm))]
-            lines.sort(key=lambda l: l[1])
-            lines_nm = [line[1] for line in lines]
-            lines_name = [line[0] for line in lines]
-            return lines_nm, lines_name
+        
+        lines_name = [
+            lines_name[isel[starts[igroup]]] if counts[igroup] == 1
+            else 'MEAN[' + ','.join(
+                lines_name[iline] for iline in isel[
+                    starts[igroup]:starts[igroup] + counts[igroup]]) + ']'
+            for igroup in igroups] + balmer_lines
+        return lines_nm, [lines_name[iline] for iline in order]
         
 
     def _to_list(self, lines):
@@ -1617,12 +1872,12 @@ class Lines(Tools):
         """
         lines_name = self._to_list(lines_name)
 
+        air_lines_nm = self.air_lines_nm
         lines_nm = list()
         for line_name in lines_name:
-            if isinstance(line_name, str):
-                lines_nm.append(self.air_lines_nm[line_name])
-            else:
+            if not isinstance(line_name, str):
                 raise Exception('line name must be a str instance')
+            lines_nm.append(air_lines_nm[line_name])
 
         if len(lines_nm) == 1:
             lines_nm = lines_nm[0]
@@ -1649,13 +1904,9 @@ class Lines(Tools):
         if isinstance(lines, (float, int, np.longdouble)):
             lines = [lines]
 
-        names = list()
-        for iline in lines:
-            if str(iline) in self.air_lines_name:
-                names.append(self.air_lines_name[str(iline)])
-            else:
-                names.append('None')
-
+        air_lines_name = self.air_lines_name
+        names = [air_lines_name.get(round(float(iline), 6), 'None')
+                 for iline in lines]
 
         if len(names) == 1: return names[0]
         else: return names
@@ -1681,9 +1932,14 @@ class ParamsFile(Tools):
 
     _params_list = None
     _keys = None
+    _keys_set = None
     _file_path = None
+    _pending_lines = None
 
     f = None
+
+    write_buffer_size = 1024 # number of rows kept in memory before writing
+    file_buffering = 65536 # size of the file buffer in bytes
     
     def __init__(self, file_path, reset=True, **kwargs):
         """Init ParamsFile class.
@@ -1702,36 +1958,55 @@ class ParamsFile(Tools):
         super().__init__(**kwargs)
         
         self._params_list = list()
+        self._pending_lines = list()
         if not reset and os.path.exists(file_path):
             self.f = orb.utils.io.open_file(file_path, 'r')
             for iline in self.f:
-                if '##' not in iline and len(iline) > 3:
-                    if '# KEYS' in iline:
+                if not iline.startswith('##') and len(iline) > 3:
+                    if iline.startswith('# KEYS'):
                         self._keys = iline.split()[2:]
                     elif self._keys is not None:
-                        iline = iline.split()
-                        line_dict = dict()
-                        for ikey in range(len(self._keys)):
-                            line_dict[self._keys[ikey]] = iline[ikey]
-                        self._params_list.append(line_dict)
+                        iline = iline.split(None, len(self._keys))
+                        if len(iline) < len(self._keys):
+                            raise Exception(
+                                'Wrong file format: {:s}'.format(file_path))
+                        self._params_list.append(dict(zip(self._keys, iline)))
                     else:
                         raise Exception(
                             'Wrong file format: {:s}'.format(file_path))
             self.f.close()
-            self.f = orb.utils.io.open_file(file_path, 'a')
+            self.f = orb.utils.io.open_file(
+                file_path, 'a', buffering=self.file_buffering)
 
         else:
-            self.f = orb.utils.io.open_file(file_path, 'w')
+            self.f = orb.utils.io.open_file(
+                file_path, 'w', buffering=self.file_buffering)
             self.f.write("## PARAMS FILE\n## created by {:s}\n".format(
                 self.__class__.__name__))
-            self.f.flush()
         self._file_path = file_path
 
     def __del__(self):
         """ParamsFile destructor"""
-        
+        self.close()
+
+    def _write_pending_lines(self):
+        """Pass the rows kept in memory to the file buffer."""
+        if self._pending_lines:
+            self.f.writelines(self._pending_lines)
+            self._pending_lines = list()
+        
+    def flush(self):
+        """Write the rows kept in memory to the file."""
+        if self.f is None: return
+        self._write_pending_lines()
+        self.f.flush()
+
+    def close(self):
+        """Write the remaining rows and close the file."""
         if self.f is not None:
+            self.flush()
             self.f.close()
+            self.f = None
 
     def __getitem__(self, key):
         """implement Instance[key]"""
@@ -1746,22 +2021,54 @@ class ParamsFile(Tools):
             self._params_list.append(params)
             self._keys = list(params.keys())
             self._keys.sort()
-            self.f.write('# KEYS')
-            for ikey in self._keys:
-                self.f.write(' {:s}'.format(ikey))
-            self.f.write('\n')
+            self._pending_lines.append(
+                ' '.join(['# KEYS'] + self._keys) + '\n')
+            self._keys_set = frozenset(self._keys)
         else:
-            keys = list(params.keys())
-            keys.sort()
-            if keys == self._keys:
+            if self._keys_set is None:
+                self._keys_set = frozenset(self._keys)
+            if self._keys_set == params.keys():
                 self._params_list.append(params)
             else:
                 raise Exception('parameters of the new entry are not the same as the old entries')
         
-        for ikey in self._keys:
-            self.f.write(' {}'.format(self._params_list[-1][ikey]))
-        self.f.write('\n')
-        self.f.flush()
+        self._pending_lines.append(
+            ' ' + ' '.join([format(params[ikey]) for ikey in self._keys]) + '\n')
+        
+        # rows are written by blocks, the file buffer is only flushed
+        # when full or when the file is closed
+        if len(self._pending_lines) >= self.write_buffer_size:
+            self._write_pending_lines()
+
+    def extend(self, params_list):
+        """Append a list of dicts to the file.
+
+        Rows are formatted as in :py:meth:`append` but the keys are
+        checked once for all the entries and the rows are passed to
+        the file buffer at once.
+
+        :param params_list: A list of dicts of parameters
+        """
+        params_list = list(params_list)
+        if len(params_list) == 0: return
+        
+        if len(self._params_list) == 0:
+            self.append(params_list.pop(0))
+            if len(params_list) == 0: return
+            
+        if self._keys_set is None:
+            self._keys_set = frozenset(self._keys)
+        for params in params_list:
+            if self._keys_set != params.keys():
+                raise Exception('parameters of the new entry are not the same as the old entries')
+            
+        self._params_list += params_list
+        self._pending_lines += [
+            ' ' + ' '.join([format(params[ikey]) for ikey in self._keys]) + '\n'
+            for params in params_list]
+        
+        if len(self._pending_lines) >= self.write_buffer_size:
+            self._write_pending_lines()
 
     def get_data(self):
         return self._params_list
@@ -1792,14 +2099,17 @@ class Waves(object):
             if np.size(nm) == 1:
                 nm = list([nm])
 
-        nm_list = list()
-        for inm in nm:
-            if isinstance(inm, str):
-                nm_list.append(Lines().get_line_nm(inm))
-            else:
-                nm_list.append(float(inm))
-
-        self.nm = np.squeeze(np.array(nm_list).astype(np.longdouble))
+        is_name = [isinstance(inm, str) for inm in nm]
+        if any(is_name):
+            # line names are resolved with direct lookups in the
+            # lines table of the shared Lines instance
+            air_lines_nm = _get_lines().air_lines_nm
+            nm = [air_lines_nm[inm] if iname else inm
+                  for inm, iname in zip(nm, is_name)]
+
+        self.nm = np.squeeze(np.asarray(nm, dtype=float))
+        # rest frame wavenumbers are computed once
+        self._cm1_rest = orb.utils.spectrum.nm2cm1(self.nm)
         self.set_velocity(velocity)
         
     def set_velocity(self, velocity):
@@ -1812,18 +2122,21 @@ class Waves(object):
         elif np.array(velocity).shape != self.nm.shape:
             raise Exception('Velocity array shape must be the same as nm shape')
         else:
-            self.velocity = np.array(velocity).astype(np.longdouble)
+            self.velocity = np.array(velocity, dtype=float)
 
     def get_nm(self):
         """Return wavelength of waves in nm (taking velocity into account)"""
-        return self.nm + orb.utils.spectrum.line_shift(
+        nm = orb.utils.spectrum.line_shift(
             self.velocity, self.nm, wavenumber=False)
+        nm += self.nm
+        return nm
 
     def get_cm1(self):
         """Return wavenumber of waves in cm-1 (taking velocity into account)"""
-        cm1 = self.get_cm1_rest()
-        return cm1 + orb.utils.spectrum.line_shift(
-            self.velocity, cm1, wavenumber=True)
+        cm1 = orb.utils.spectrum.line_shift(
+            self.velocity, self._cm1_rest, wavenumber=True)
+        cm1 += self._cm1_rest
+        return cm1
 
     def get_nm_rest(self):
         """"Return restframe wavelength of waves in nm"""
@@ -1831,7 +2144,7 @@ class Waves(object):
 
     def get_cm1_rest(self):
         """Return restframe wavelength of waves in cm-1"""
-        return orb.utils.spectrum.nm2cm1(self.nm)
+        return np.copy(self._cm1_rest)
 
 #################################################
 #### CLASS Data #################################
@@ -1877,11 +2190,16 @@ class Data(object):
 
         """        
         LIMIT_SIZE = 2 # Gb
-                
+
+        # True if self.params is created here and not shared with
+        # another object
+        own_params = False
+        
         # load from file
         if isinstance(data, str):
             self.axis = None
-            self.params = dict()
+            self.params = ROParams()
+            own_params = True
             self.mask = None
             self.err = None
 
@@ -1909,33 +2227,29 @@ class Data(object):
                         if np.any(memsize > LIMIT_SIZE):
                             raise Exception('file too big to be opened this way: {} Gb > {} Gb'.format(memsize, LIMIT_SIZE))
                     
-                    self.data = hdffile[_data_path][:]
+                    self.data = orb.utils.io.read_hdf5_dataset(
+                        hdffile[_data_path])
 
                     # load params
-                    for iparam in hdffile.attrs:
-                        try:
-                            ivalue = hdffile.attrs[iparam]
-                            if isinstance(ivalue, bytes):
-                                ivalue = ivalue.decode()
-                            self.params[iparam] = ivalue
-                        except TypeError as e:
-                            logging.debug('error reading param from attributes {}: {}'.format(
-                                iparam, e))
+                    self.params.update(orb.utils.io.read_hdf5_attrs(hdffile))
 
                     # load axis
                     if '/axis' in hdffile:
                         if axis is None:
-                            self.axis = Axis(hdffile['/axis'][:])
+                            self.axis = Axis(orb.utils.io.read_hdf5_dataset(
+                                hdffile['/axis']))
 
                     # load err
                     if '/err' in hdffile:
                         if err is None:
-                            self.err = hdffile['/err'][:]
+                            self.err = orb.utils.io.read_hdf5_dataset(
+                                hdffile['/err'])
 
                     # load mask
                     if '/mask' in hdffile:
                         if mask is None:
-                            self.mask = hdffile['/mask'][:]
+                            self.mask = orb.utils.io.read_hdf5_dataset(
+                                hdffile['/mask'])
             else:
                 raise ValueError('extension not recognized, must be fits or hdf5')
 
@@ -1975,12 +2289,15 @@ class Data(object):
         # load from np.ndarray
         else:
             self.axis = None
-            self.params = dict()
+            self.params = ROParams()
+            own_params = True
             self.mask = None
             self.err = None
 
             if not isinstance(data, np.ndarray):
                 raise TypeError('input data is a {} but must be a numpy.ndarray'.format(type(data)))
+            # the input array is always copied (once): the instance
+            # must not share its data with the caller
             data = np.squeeze(np.copy(data))
             if data.ndim > 3: raise TypeError('data dimension > 3 is not supported')
             self.data = data
@@ -1995,7 +2312,7 @@ class Data(object):
 
         # reduce complex data to real data if imaginary part is null
         if np.iscomplexobj(self.data):
-            if not np.any(np.iscomplex(self.data)):
+            if not np.any(self.data.imag):
                 try:
                     self.data = self.data.real
                 except AttributeError:
@@ -2050,13 +2367,18 @@ class Data(object):
                     raise TypeError('mask has shape {} but must have shape {}'.format(mask.shape, self.data.shape[0:2]))
             self.mask = mask
                
-        self.params = ROParams(self.params) # self.params must always be an ROParams instance
+        # self.params must always be an ROParams instance, only copied
+        # if it is not already a private ROParams instance
+        if not own_params or not isinstance(self.params, ROParams):
+            self.params = ROParams(self.params)
         
     def __getitem__(self, key):
         _data = self.data.__getitem__(key)
         if self.has_mask():
             if _data.size > 1:
-                _data[np.nonzero(self.mask.__getitem__(key) == 0)] = np.nan
+                # branchless select: returns a new array, self.data is
+                # never modified when key is a simple slice
+                _data = np.where(self.mask.__getitem__(key), _data, np.nan)
             else:
                 if not self.mask.__getitem__(key): _data = np.nan
         return _data
@@ -2252,13 +2574,14 @@ class Data(object):
         :param kwargs: Addition kwargs (useful to copy child classes
           with more kwargs at init)
         """
+        # params, data and axis are copied by the new instance at init
         if self.has_params():
-            _params = self.params.convert()
+            _params = self.params
         else:
             _params = None
 
         if self.has_axis():
-            _axis = np.copy(self.axis.data)
+            _axis = self.axis.data
         else:
             _axis = None
 
@@ -2273,7 +2596,7 @@ class Data(object):
             _mask = None
 
         if data is None:
-            data = np.copy(self.data)
+            data = self.data
 
         return self.__class__(
             data,
@@ -2283,10 +2606,13 @@ class Data(object):
             mask=_mask,
             **kwargs)
         
-    def writeto(self, path):
+    def writeto(self, path, compress=False):
         """Write data to an hdf file
 
         :param path: hdf file path.
+
+        :param compress: (Optional) If True, datasets are compressed
+          (default False).
         """
         if np.iscomplexobj(self.data):
             _data = self.data.astype(complex)
@@ -2310,7 +2636,9 @@ class Data(object):
 
             hdffile.create_dataset(
                 '/data',
-                data=_data)
+                data=_data,
+                **orb.utils.io.get_data_dataset_kwargs(
+                    _data.shape, compress=compress))
 
             if self.has_axis():
                 hdffile.create_dataset(
@@ -2320,12 +2648,16 @@ class Data(object):
             if self.has_mask():
                 hdffile.create_dataset(
                     '/mask',
-                    data=self.mask)
+                    data=self.mask,
+                    **orb.utils.io.get_data_dataset_kwargs(
+                        self.mask.shape, compress=compress))
 
             if self.has_err():
                 hdffile.create_dataset(
                     '/err',
-                    data=self.err)
+                    data=self.err,
+                    **orb.utils.io.get_data_dataset_kwargs(
+                        self.err.shape, compress=compress))
 
 
     def to_fits(self, path):
@@ -2456,28 +2788,28 @@ class Vector1d(Data):
                        * (self.axis.data[1] - self.axis.data[0]) * ax_ratio
                        + self.axis.data[0])
             if timing: times.append(time.time()) ####
-            f = scipy.interpolate.interp1d(zp_axis,
-                                           zp_spec,
-                                           bounds_error=False)
+            old_axis, old_data = zp_axis, zp_spec
             
         else:
             logging.debug('data is not complex and is interpolated the bad way')
             if timing: times.append(time.time()) ####
-            f = scipy.interpolate.interp1d(self.axis.data.astype(np.longdouble),
-                                           self.data.real.astype(np.longdouble),
-                                           bounds_error=False)
+            old_axis = self.axis.data.astype(np.float64)
+            old_data = self.data.real.astype(np.float64)
             # (added to get the same number of timings as if data is
             # complex)
             if timing: times.append(time.time()) 
-            
+
+        # linear interpolation, NaN out of the old axis
+        new_axis_data = new_axis.data.astype(np.float64)
         if timing: times.append(time.time()) ####
-        data  = f(new_axis.data)
+        data = np.interp(new_axis_data, old_axis, old_data,
+                         left=np.nan, right=np.nan)
         if timing: times.append(time.time()) ####
             
         if self.has_err():
-            new_err = scipy.interpolate.interp1d(self.axis.data.astype(np.longdouble),
-                                                 self.err.astype(np.longdouble),
-                                                 bounds_error=False)(new_axis.data)
+            new_err = np.interp(
+                new_axis_data, self.axis.data.astype(np.float64),
+                self.err.astype(np.float64), left=np.nan, right=np.nan)
         else:
             new_err = None
 
@@ -2654,19 +2986,33 @@ class Vector1d(Data):
 class Axis(Vector1d):
     """Axis class"""
 
-    def __init__(self, data, axis=None, params=None, mask=None, **kwargs):
+    def __init__(self, data, axis=None, params=None, mask=None, _trusted=False,
+                 **kwargs):
         """Init class with an axis vector
 
         :param data: 1d np.ndarray.
+
+        :param _trusted: (Optional) If True, data is known to be
+          regularly sampled and naturally ordered (e.g. created with
+          orb.utils.spectrum.create_cm1_axis) and is not checked
+          (default False).
         """
         if axis is not None: raise ValueError('axis must be set to None')
         if mask is not None: raise ValueError('mask must be set to None')
         
         super().__init__(data, **kwargs)
 
-        # check that axis is regularly sampled
+        if _trusted:
+            self.axis_step = self.data[1] - self.data[0]
+            self._axis_step_float = float(self.axis_step)
+            return
+        
+        # check that axis is regularly sampled (the steps must not
+        # differ from the first one by more than 1e-8, the absolute
+        # tolerance of np.isclose), NaNs are considered irregular
         diff = np.diff(self.data)
-        if np.any(~np.isclose(diff - diff[0], 0.)):
+        step = diff[0]
+        if not (diff.max() - step <= 1e-8 and step - diff.min() <= 1e-8):
             # handle old low precision axes (stored as float16)
             if np.all(np.abs((diff - diff[0]) / np.abs(diff)) < 1e-3):
                 self.data = np.linspace(self.data[0], self.data[-1], self.data.size)
@@ -2678,6 +3024,7 @@ class Axis(Vector1d):
             raise Exception('axis must be naturally ordered')
 
         self.axis_step = diff[0]
+        self._axis_step_float = float(self.axis_step)
 
     def __call__(self, pos):
         """return the position in channels from an input in axis unit
@@ -2686,7 +3033,7 @@ class Axis(Vector1d):
 
         :return: Position in index
         """
-        pos_index = (pos - self.data[0]) / float(self.axis_step)
+        pos_index = (pos - self.data[0]) / self._axis_step_float
         if np.any(pos_index < 0) or np.any(pos_index >= self.dimx):
             logging.warning('requested position is off axis')
         return pos_index
@@ -2698,7 +3045,7 @@ class Axis(Vector1d):
 
         :return: Value in axis unit
         """
-        return self.data[0] + float(self.axis_step) * pos
+        return self.data[0] + self._axis_step_float * pos
             
 
     
@@ -2754,12 +3101,19 @@ class Cm1Vector1d(Vector1d):
 
         if self.has_params():
             if len(set(self.obs_params).intersection(self.params)) == len(self.obs_params):
-                check_axis = orb.utils.spectrum.create_cm1_axis(
-                    self.dimx, self.params.step, self.params.order, corr=self.params.calib_coeff)
                 if self.axis is None:
-                    self.axis = Axis(check_axis)
+                    self.axis = Axis(orb.utils.spectrum.create_cm1_axis(
+                        self.dimx, self.params.step, self.params.order,
+                        corr=self.params.calib_coeff), _trusted=True)
                 else:
-                    if np.any(check_axis != self.axis.data):
+                    # the axis is known to be regular: its size and
+                    # bounds are enough to check it
+                    cm1_min, cm1_max = orb.utils.spectrum.get_cm1_axis_bounds(
+                        self.dimx, self.params.step, self.params.order,
+                        corr=self.params.calib_coeff)
+                    if (self.axis.dimx != self.dimx
+                        or not np.isclose(self.axis.data[0], cm1_min, rtol=1e-10, atol=0)
+                        or not np.isclose(self.axis.data[-1], cm1_max, rtol=1e-10, atol=0)):
                         logging.debug('provided axis is inconsistent with the given parameters')
             #else:
                 #raise StandardError('{} must all be provided'.format(self.obs_params))
@@ -2784,14 +3138,18 @@ class Cm1Vector1d(Vector1d):
             
     def get_filter_bandpass_cm1(self):
         """Return filter bandpass in cm-1"""
-        if 'filter_cm1_min' not in self.params or 'filter_cm1_max' not in self.params:
+        # plain dict lookups: this method is called for each spectrum
+        # in cube-wide loops
+        cm1_min = dict.get(self.params, 'filter_cm1_min', _NOT_SET)
+        cm1_max = dict.get(self.params, 'filter_cm1_max', _NOT_SET)
+        if cm1_min is _NOT_SET or cm1_max is _NOT_SET:
             
             cm1_min, cm1_max = FilterFile(self.params.filter_name).get_filter_bandpass_cm1()
             logging.debug('Uneffective call to get filter bandpass. Please provide filter_cm1_min and filter_cm1_max in the parameters.')
             self.set_param('filter_cm1_min', cm1_min)
             self.set_param('filter_cm1_max', cm1_max)
             
-        return self.params.filter_cm1_min, self.params.filter_cm1_max
+        return cm1_min, cm1_max
 
     def get_filter_bandpass_pix(self, border_ratio=0.):
         """Return filter bandpass in channels
@@ -2806,8 +3164,9 @@ class Cm1Vector1d(Vector1d):
         if not -0.2 <= border_ratio <= 0.2:
             raise ValueError('border ratio must be between -0.2 and 0.2')
 
-        zmin = int(self.axis(self.get_filter_bandpass_cm1()[0]))
-        zmax = int(self.axis(self.get_filter_bandpass_cm1()[1]))
+        cm1_min, cm1_max = self.get_filter_bandpass_cm1()
+        zmin = int(self.axis(cm1_min))
+        zmax = int(self.axis(cm1_max))
         if border_ratio != 0:
             border = int((zmax - zmin) * border_ratio)
             zmin += border
@@ -2818,6 +3177,13 @@ class Cm1Vector1d(Vector1d):
     def mean_in_filter(self):
         ff = FilterFile(self.params.filter_name)
         ftrans = ff.get_transmission(self.dimx)
+        if self.has_axis() and np.array_equal(self.axis.data, ftrans.axis.data):
+            # same axis: no projection needed, a dot product is
+            # enough when there is no NaN
+            total = np.dot(self.data, ftrans.data)
+            if np.isnan(total):
+                total = np.nansum(self.data * ftrans.data)
+            return total / ftrans.sum()
         return np.nansum(self.multiply(ftrans).data) / ftrans.sum()
 
     def velocity_shift(self, velocity):
@@ -2865,6 +3231,10 @@ class FilterFile(Vector1d):
 
     needed_params = ('step', 'order', 'phase_fit_order', 'modulation_efficiency',
                      'bandpass_min_nm', 'bandpass_max_nm', 'instrument')
+
+    # transmissions shared by all instances, keyed by (filter file
+    # path, step_nb, corr, step, order)
+    _transmission_cache = dict()
     
     def __init__(self, filter_name, axis=None, params=None, **kwargs):
         """Initialize FilterFile class.
@@ -2922,11 +3292,17 @@ class FilterFile(Vector1d):
         if corr is None:
             corr = orb.utils.spectrum.theta2corr(
                 self.tools.config['OFF_AXIS_ANGLE_CENTER'])
-        cm1_axis = Axis(orb.utils.spectrum.create_cm1_axis(
-            step_nb, self.params.step, self.params.order,
-            corr=corr))
+
+        # projected transmissions are cached
+        key = (os.path.abspath(self.basic_path), int(step_nb), float(corr),
+               float(self.params.step), int(self.params.order))
+        if key not in FilterFile._transmission_cache:
+            cm1_axis = Axis(orb.utils.spectrum.create_cm1_axis(
+                step_nb, self.params.step, self.params.order,
+                corr=corr), _trusted=True)
+            FilterFile._transmission_cache[key] = self.project(cm1_axis)
     
-        return self.project(cm1_axis)
+        return FilterFile._transmission_cache[key].copy()
             
     def get_modulation_efficiency(self):
         """Return modulation efficiency."""
@@ -2981,7 +3357,7 @@ class FilterFile(Vector1d):
         _nm_min -= _nm_range * 0.05
         _nm_max += _nm_range * 0.05
 
-        _lines_nm = Lines().get_sky_lines(
+        _lines_nm = _get_lines().get_sky_lines(
             _nm_min, _nm_max, _delta_nm)
 
         return orb.utils.spectrum.nm2cm1(_lines_nm)
@@ -3016,6 +3392,10 @@ class WCSData(Tools, Data):
                       'CAMERA': 'camera',
                       'BINNING': 'binning'}
 
+    # at least one of these FITS keywords must be in the params to
+    # define a WCS
+    wcs_keywords = ('CTYPE1', 'CRVAL1', 'CD1_1', 'PC1_1', 'CDELT1')
+
     def __init__(self, data, instrument=None, config=None,
                  data_prefix="./", sip=None, reset_wcs=False, **kwargs):
 
@@ -3207,11 +3587,11 @@ class WCSData(Tools, Data):
         #         sip = self.load_sip(self._get_sip_file_path(self.params.camera))
         #         logging.debug('SIP Loaded from{}\n{}'.format(
         #             self._get_sip_file_path(self.params.camera), sip))
-        else:
-            sip = self.get_wcs()
             
         # reset wcs
         if reset_wcs:
+            if sip is None:
+                sip = self.get_wcs()
             wcs = orb.utils.astrometry.create_wcs(
                 self.params.target_x, self.params.target_y,
                 self.params.delta_x, self.params.delta_y,
@@ -3309,18 +3689,35 @@ class WCSData(Tools, Data):
 
     def get_wcs(self, validate=True):
         """Return the WCS of the cube as an astropy.wcs.WCS instance """
-        if validate: self.validate_wcs()
         warnings.simplefilter('ignore', category=VerifyWarning)
         warnings.simplefilter('ignore', category=AstropyUserWarning)
-        return pywcs.WCS(self.get_header(), naxis=2, relax=True)
-
-    def validate_wcs(self):
+        wcs = pywcs.WCS(self.get_header(), naxis=2, relax=True)
+        if validate: self.validate_wcs(wcs=wcs)
+        return wcs
+
+    def has_wcs_keywords(self):
+        """Return True if the params contain at least one WCS FITS keyword"""
+        for ikey in self.wcs_keywords:
+            if ikey in self.params: return True
+        return False
+    
+    def validate_wcs(self, wcs=None):
         """Verify the internal coherence between comprehensive wcs parameters
         and FITS keywords.
+
+        :param wcs: (Optional) An astropy.wcs.WCS instance already
+          built from the params. If None, it is built from the params
+          if they contain WCS FITS keywords (default None).
         """
+        if wcs is None:
+            if not self.has_wcs_keywords():
+                logging.debug('no WCS keywords in header')
+                return
+            wcs = self.get_wcs(validate=False)
+            
         try:
             _fits_params = np.array(orb.utils.astrometry.get_wcs_parameters(
-                self.get_wcs(validate=False)))
+                wcs))
         except Exception:
             logging.warning('bad WCS in header')
             return
@@ -3519,12 +3916,15 @@ class WCSData(Tools, Data):
         return coeffs
 
 
-    def writeto(self, path):
+    def writeto(self, path, compress=False):
         """Write data to an hdf file
 
         :param path: hdf file path.
+
+        :param compress: (Optional) If True, datasets are compressed
+          (default False).
         """
-        Data.writeto(self, path)
+        Data.writeto(self, path, compress=compress)
         with orb.utils.io.open_hdf5(path, 'a') as hdffile:
             if self.has_dxdymaps():
                 hdffile.create_dataset(
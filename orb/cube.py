@@ -34,6 +34,7 @@ import orb.core
 import orb.old
 import orb.utils.io
 import orb.utils.misc
+import orb.utils.parallel
 import orb.utils.astrometry
 import orb.utils.err
 import orb.fft
@@ -50,6 +51,18 @@ import orb.photometry
 import gc
 import h5py
 
+# registers the compression filters used by compressed cubes
+try: import hdf5plugin
+except ImportError: pass
+
+# version of the layout of the cube files, stored in their
+# 'format_version' attribute (files without it are version 1). Files
+# with a newer version than this one cannot be read.
+#  - 1: one 'frame_header_{index}' dataset per frame header
+#  - 2: all the frame headers in a single 'frame_headers' dataset
+#  - 3: mask stored with 1 bit per pixel
+CUBE_FORMAT_VERSION = 3
+
 
 
 
@@ -87,10 +100,17 @@ class HDFCube(orb.core.WCSData):
     optional_params = ('target_ra', 'target_dec', 'target_x', 'target_y',
                        'dark_time', 'flat_time', 'camera', 'wcs_rotation',
                        'calibration_laser_map_path')
+
+    _chunk_iter_warned = False # True once the chunk_iter warning is logged
+
+    _hdf5f = None # h5py.File kept opened in read mode (see _get_hdf5f)
+    _data_dset = None # data dataset of self._hdf5f
+    _rdcc_nbytes = None # size of the HDF5 chunk cache
+    upcast = True # if True, data read with getitem is upcasted
     
     def __init__(self, path, indexer=None,
                  instrument=None, config=None, data_prefix='./',
-                 **kwargs):
+                 rdcc_nbytes=None, upcast=True, **kwargs):
 
         """Init HDFCube
 
@@ -104,9 +124,22 @@ class HDFCube(orb.core.WCSData):
           'spiomm'). If it cannot be read from the file itself (in
           attributes) it must be set.
 
+        :param rdcc_nbytes: (Optional) Size in bytes of the HDF5 raw
+          data chunk cache used to read and write the cube. Must be
+          large enough to hold all the chunks touched by a frame. If
+          None, orb.utils.io.HDF5_CHUNK_CACHE_SIZE is used (default
+          None).
+
+        :param upcast: (Optional) If True, float32 and complex64 data
+          read with cube[...] is returned as float64 and
+          complex128. If False, data is returned with its storing
+          type, which halves the memory used (default True).
+
         :param kwargs: (Optional) :py:class:`~orb.orb.core.Data` kwargs.
         """
         self.cube_path = str(path)
+        self._rdcc_nbytes = rdcc_nbytes
+        self.upcast = bool(upcast)
 
         if not os.path.exists(self.cube_path):
             raise IOError('File {} does not exist'.format(self.cube_path))
@@ -118,6 +151,7 @@ class HDFCube(orb.core.WCSData):
         
         if isinstance(self.cube_path, str):
             with orb.utils.io.open_hdf5(self.cube_path, 'r') as f:
+                self._check_format_version(f)
                 if self.is_level1():
                     self.oldcube = orb.old.HDFCube(self.cube_path, silent_init=True)
                     self.data = MockArray()
@@ -130,16 +164,8 @@ class HDFCube(orb.core.WCSData):
                 self.axis = None
                 self.mask = None
                 self.err = None
-                self.params = orb.core.ROParams()
-                for param in f.attrs:
-                    try:
-                        param_value = f.attrs[param]
-                        if isinstance(param_value, bytes):
-                            param_value = param_value.decode()
-                        self.params[param] = param_value
-                    except TypeError as e:
-                        logging.debug('error reading param from attributes {}: {}'.format(
-                            param, e))
+                self.params = orb.core.ROParams(
+                    orb.utils.io.read_hdf5_attrs(f))
 
                 if 'instrument' in self.params and instrument is None:
                     instrument = self.params['instrument']
@@ -183,24 +209,124 @@ class HDFCube(orb.core.WCSData):
 
     def __getitem__(self, key):
         """Implement getitem special method"""
+        return self._read_data(key, upcast=self.upcast)
+
+    def _read_data(self, key, upcast=True):
+        """Read a part of the data cube.
+
+        :param key: Index or tuple of slices.
+
+        :param upcast: (Optional) If True, float32 and complex64 data
+          is returned as float64 and complex128 (see
+          :py:meth:`_upcast`). If False, data is returned with its
+          storing type (default True).
+        """
         if self.is_level1():
             if self.has_dataset('mask'):
                 logging.warning('mask is not handled for old cubes format')
-            return self.oldcube.__getitem__(key)
+            _data = self.oldcube.__getitem__(key)
+            if upcast: _data = self._upcast(_data)
+            return _data
         
-        with self.open_hdf5() as f:
-            _data = np.copy(f['data'].__getitem__(key))
+        f = self._get_hdf5f()
+        _data = np.copy(self._get_data_dset().__getitem__(key))
             
-            if 'mask' in f:
-                _data *= f['mask'].__getitem__((key[0], key[1]))
-
-        # increase representation in case of complex or floats
-        if _data.dtype == np.float32:
-            _data = _data.astype(np.float64)
-        elif _data.dtype == np.complex64:
-            _data = _data.astype(np.complex128)
+        if 'mask' in f:
+            _mask = self._read_mask(f, key[0], key[1])
+            # the 2d mask applies to every frame
+            _data *= _mask.reshape(_mask.shape + (1,) * (_data.ndim - _mask.ndim))
 
+        if upcast: _data = self._upcast(_data)
         return np.squeeze(_data)
+
+    def _check_format_version(self, f):
+        """Raise an exception if the cube file has a newer layout than
+        the ones this version of ORB can read (see
+        CUBE_FORMAT_VERSION).
+
+        :param f: Opened HDF5 file.
+        """
+        version = int(f.attrs.get('format_version', 1))
+        if version > CUBE_FORMAT_VERSION:
+            raise Exception('{} has the file format version {} but this version of ORB can only read versions up to {}. Please update ORB.'.format(self.cube_path, version, CUBE_FORMAT_VERSION))
+
+    def __getstate__(self):
+        """Used to pickle object (the opened file is not pickled)"""
+        state = self.__dict__.copy()
+        state.pop('_hdf5f', None)
+        state.pop('_data_dset', None)
+        return state
+    
+    def _get_hdf5f(self):
+        """Return the HDF5 file opened in read mode.
+
+        The file is opened at the first call and kept open until
+        :py:meth:`close` is called or until the file is opened in
+        write mode.
+
+        .. warning:: While the file is kept open, it cannot be opened
+          in write mode by another object of the same process (HDF5
+          refuses to reopen a file already opened read-only). Call
+          :py:meth:`close` on every reading cube before writing the
+          same file from another cube object.
+        """
+        if self._hdf5f is None or not self._hdf5f.id.valid:
+            self._data_dset = None
+            self._hdf5f = orb.utils.io.open_hdf5(
+                self.cube_path, 'r', large_cache=True,
+                rdcc_nbytes=self._rdcc_nbytes)
+        return self._hdf5f
+
+    def _get_data_dset(self):
+        """Return the data dataset of the file returned by
+        :py:meth:`_get_hdf5f`.
+        """
+        f = self._get_hdf5f()
+        if self._data_dset is None or not self._data_dset.id.valid:
+            self._data_dset = f['data']
+        return self._data_dset
+
+    def close(self):
+        """Close the HDF5 file kept opened for reading (and the files
+        opened by the old cube of a level 1 cube)."""
+        self._data_dset = None
+        if self._hdf5f is not None:
+            if self._hdf5f.id.valid:
+                self._hdf5f.close()
+            self._hdf5f = None
+        if hasattr(self, 'oldcube'):
+            self.oldcube.close()
+
+    def _read_mask(self, f, x_key, y_key):
+        """Read a part of the mask.
+
+        Masks stored with 1 bit per pixel (with a 'packed_shape'
+        attribute) are unpacked.
+
+        :param f: Opened HDF5 file.
+
+        :param x_key: Index or slice along x axis.
+
+        :param y_key: Index or slice along y axis.
+        """
+        dset = f['mask']
+        if 'packed_shape' not in dset.attrs:
+            return dset[x_key, y_key]
+        dimy = dset.attrs['packed_shape'][-1]
+        return np.unpackbits(
+            dset[x_key], axis=-1)[..., :dimy][..., y_key].view(bool)
+
+    def _upcast(self, data):
+        """Increase the representation of float32 and complex64 data
+        (as stored on disk) to float64 and complex128.
+
+        :param data: data array
+        """
+        if data.dtype == np.float32:
+            return data.astype(np.float64)
+        elif data.dtype == np.complex64:
+            return data.astype(np.complex128)
+        return data
     
     def _read_old_header(self):
         """Backward compatibility method. Read old 'header' dataset and return a dict()
@@ -297,6 +423,27 @@ class HDFCube(orb.core.WCSData):
     
     def copy(self):
         raise NotImplementedError('HDFCube instance cannot be copied')
+
+    def _iter_chunks(self, dset):
+        """Return the storage information of all the allocated chunks
+        of a dataset.
+
+        Each element is an h5py StoreInfo tuple (chunk_offset,
+        filter_mask, byte_offset, size).
+
+        :param dset: An opened h5py dataset.
+        """
+        chunks = list()
+        try:
+            # one pass over the chunk index
+            dset.id.chunk_iter(chunks.append)
+        except AttributeError: # h5py < 3.8 or HDF5 < 1.12.3
+            if not HDFCube._chunk_iter_warned:
+                logging.warning('chunk_iter not available, chunks are listed one by one (can be very slow for large cubes)')
+                HDFCube._chunk_iter_warned = True
+            chunks = [dset.id.get_chunk_info(i)
+                      for i in range(dset.id.get_num_chunks())]
+        return chunks
     
     def open_hdf5(self, mode='r'):
         """Return a handle on the hdf5 file.
@@ -306,7 +453,12 @@ class HDFCube(orb.core.WCSData):
         if mode not in ['r', 'a', 'r+']:
             raise ValueError('mode is {} and must be r, r+ or a'.format(mode))
 
-        return orb.utils.io.open_hdf5(self.cube_path, mode)
+        # the file cannot be opened for writing while it is kept
+        # opened for reading
+        if mode != 'r': self.close()
+        
+        return orb.utils.io.open_hdf5(self.cube_path, mode, large_cache=True,
+                                      rdcc_nbytes=self._rdcc_nbytes)
         
     
     def get_data(self, x_min, x_max, y_min, y_max, z_min, z_max, silent=False):
@@ -329,12 +481,65 @@ class HDFCube(orb.core.WCSData):
 
         """
         if self.is_level1():
-            return self.oldcube.get_data(
+            return self._upcast(self.oldcube.get_data(
                 x_min, x_max, y_min, y_max, z_min, z_max,
-                silent=silent)
+                silent=silent))
         
         return self[x_min:x_max, y_min:y_max, z_min:z_max]
 
+    def get_frames(self, indices, x_slice=None, y_slice=None):
+        """Return a set of frames.
+
+        The file is opened only once and frames are read in increasing
+        index order.
+
+        :param indices: Indices of the frames.
+
+        :param x_slice: (Optional) Slice along x axis. If None, the
+          whole axis is returned (default None).
+
+        :param y_slice: (Optional) Slice along y axis. If None, the
+          whole axis is returned (default None).
+
+        :return: a 3d array, the frames being ordered along the last
+          axis as in indices. Its type follows :py:attr:`upcast`.
+        """
+        if x_slice is None: x_slice = slice(None)
+        if y_slice is None: y_slice = slice(None)
+        if not isinstance(x_slice, slice) or not isinstance(y_slice, slice):
+            raise TypeError('x_slice and y_slice must be slice instances')
+        
+        indices = np.atleast_1d(np.asarray(indices, dtype=int))
+        order = np.argsort(indices)
+        
+        if self.is_level1():
+            frames = None
+            for i in order:
+                iframe = self[x_slice, y_slice, int(indices[i])]
+                if frames is None:
+                    frames = np.empty(iframe.shape + (indices.size,),
+                                      dtype=iframe.dtype)
+                frames[:,:,i] = iframe
+            return frames
+            
+        shape = (len(range(*x_slice.indices(self.dimx))),
+                 len(range(*y_slice.indices(self.dimy))),
+                 indices.size)
+        
+        with self.open_hdf5() as f:
+            dset = f['data']
+            frames = np.empty(shape, dtype=dset.dtype)
+            for i in order:
+                dset.read_direct(
+                    frames, source_sel=np.s_[x_slice, y_slice, int(indices[i])],
+                    dest_sel=np.s_[:, :, i])
+                
+            if 'mask' in f:
+                frames *= self._read_mask(f, x_slice, y_slice)[:,:,np.newaxis]
+
+        if self.upcast: frames = self._upcast(frames)
+        return frames
+
     def get_region(self, region, integrate=True):
         """Return a list of valid pixels from a ds9 region file or a ds9-style
         region definition
@@ -443,11 +648,8 @@ class HDFCube(orb.core.WCSData):
         with self.open_hdf5('r') as f:
             if path not in f:
                 raise AttributeError('{} dataset not in the hdf5 file'.format(path))
-            attrs = f[path].attrs
-            out = dict()
-            for i in list(attrs.keys()):
-                out[i] = attrs[i]
-            return out
+            # names and values are read in a single pass
+            return dict(f[path].attrs.items())
 
 
     def get_datasets(self):
@@ -489,19 +691,32 @@ class HDFCube(orb.core.WCSData):
         if binning < 2:
             raise ValueError('Bad binning value')
         logging.info('Binning interferogram cube')
-        image0_bin = orb.utils.image.nanbin_image(
-            self.get_data_frame(0), binning)
-
-        cube_bin = np.empty((image0_bin.shape[0],
-                             image0_bin.shape[1],
-                             self.dimz), dtype=float)
-        cube_bin.fill(np.nan)
-        cube_bin[:,:,0] = image0_bin
-        progress = orb.core.ProgressBar(self.dimz-1)
-        for ik in range(1, self.dimz):
+
+        get_frame = self.get_data_frame
+        if not self.is_level1():
+            if 'mask' not in self._get_hdf5f():
+                # frames are read directly (and upcasted by HDF5)
+                dset = self._get_data_dset()
+                dtype = self._upcast(np.empty(0, dtype=dset.dtype)).dtype
+                def get_frame(ik):
+                    frame = np.empty((self.dimx, self.dimy), dtype=dtype)
+                    dset.read_direct(frame, np.s_[:,:,ik])
+                    return frame
+
+        # frames are read in this thread and binned in parallel
+        cube_bin = None
+        progress = orb.core.ProgressBar(self.dimz)
+        for ik, iframe_bin in enumerate(orb.utils.parallel.imap_threads(
+                lambda frame: orb.utils.image.nanbin_image(frame, binning),
+                (get_frame(ik) for ik in range(self.dimz)),
+                ncpus=self._get_thread_nb())):
+            if cube_bin is None:
+                cube_bin = np.empty((iframe_bin.shape[0],
+                                     iframe_bin.shape[1],
+                                     self.dimz), dtype=float)
+                cube_bin.fill(np.nan)
+            cube_bin[:,:,ik] = iframe_bin
             progress.update(ik, info='Binning cube')
-            cube_bin[:,:,ik] = orb.utils.image.nanbin_image(
-                self.get_data_frame(ik), binning)
         progress.end()
         return cube_bin
 
@@ -520,16 +735,33 @@ class HDFCube(orb.core.WCSData):
           containing star-like objects (a linear interpolation must
           be done in this case).
         """
-        resized_cube = np.empty((size_x, size_y, self.dimz), dtype=self.dtype)
         x = np.arange(self.dimx)
         y = np.arange(self.dimy)
-        x_new = np.linspace(0, self.dimx, num=size_x)
-        y_new = np.linspace(0, self.dimy, num=size_y)
+        # points out of the frame take the value at its edge, as with
+        # scipy.interpolate.RectBivariateSpline
+        x_new = np.clip(np.linspace(0, self.dimx, num=size_x), 0, self.dimx - 1)
+        y_new = np.clip(np.linspace(0, self.dimy, num=size_y), 0, self.dimy - 1)
+
+        def resize_frame(frame):
+            # the bicubic interpolating spline of RectBivariateSpline
+            # is separable: it is computed along x, then along y
+            frame = scipy.interpolate.make_interp_spline(
+                x, frame, k=3, axis=0)(x_new)
+            return scipy.interpolate.make_interp_spline(
+                y, frame, k=3, axis=1)(y_new)
+        
+        # frames are read in this thread and interpolated in parallel
+        resized_cube = None
         progress = orb.core.ProgressBar(self.dimz)
-        for _ik in range(self.dimz):
-            z = self.get_data_frame(_ik)
-            interp = scipy.interpolate.RectBivariateSpline(x, y, z)
-            resized_cube[:,:,_ik] = interp(x_new, y_new)
+        for _ik, iframe in enumerate(orb.utils.parallel.imap_threads(
+                resize_frame,
+                (self.get_data_frame(_ik) for _ik in range(self.dimz)),
+                ncpus=self._get_thread_nb())):
+            if resized_cube is None:
+                # same type as the frames read
+                resized_cube = np.empty(
+                    (size_x, size_y, self.dimz), dtype=iframe.dtype)
+            resized_cube[:,:,_ik] = iframe
             progress.update(_ik, info="resizing cube")
         progress.end()
         data = np.array(resized_cube)
@@ -634,22 +866,60 @@ class HDFCube(orb.core.WCSData):
         return (self.get_dataset('dxmap'),
                 self.get_dataset('dymap'))
     
-    def compute_sum_image(self, step_size=100):
+    def _get_thread_nb(self):
+        """Return the number of threads used to process the frames in
+        parallel (0, i.e. all cpus, if no instrument configuration is
+        loaded).
+        """
+        try:
+            return self._get_ncpus()
+        except (AttributeError, KeyError):
+            return 0
+        
+    def _get_slab_size(self, max_bytes=256 * 1024 * 1024):
+        """Return the number of frames that can be read at once to
+        stream the cube along z axis.
+
+        The slab is kept under a maximum size in memory and, for a
+        chunked cube, is a multiple of the chunk size along z so that
+        each chunk is read only once.
+
+        :param max_bytes: (Optional) Maximum size of a slab in
+          memory, in bytes (default 256 MB).
+        """
+        # frames are upcasted at reading (see _upcast)
+        frame_bytes = self.dimx * self.dimy * 16
+        step_size = max(1, int(max_bytes // frame_bytes))
+        if self.is_level1(): return step_size
+        
+        chunks = self._get_data_dset().chunks
+        if chunks is not None:
+            step_size = max(chunks[2], step_size - step_size % chunks[2])
+        return min(step_size, self.dimz)
+    
+    def compute_sum_image(self, step_size=None):
         """compute the sum along z axis
+
+        :param step_size: (Optional) Number of frames read at
+          once. If None, it is chosen to read the cube by slabs of
+          whole chunks (default None).
         """
+        if step_size is None:
+            step_size = self._get_slab_size()
         sum_im = None
         progress = orb.core.ProgressBar(self.dimz)
         for ik in range(0, self.dimz, step_size):
             progress.update(ik, info="Creating sum image")
             frames = self[:,:,ik:ik+step_size]
+            frames = np.reshape(frames, (self.dimx, self.dimy, -1))
+            # NaNs are skipped with a boolean mask instead of a
+            # zero-filled copy of the frames (as done by nansum)
+            isum = np.sum(frames, axis=2, where=~np.isnan(frames))
             if sum_im is None: # avoid creating a zeros frame with a
                                # possibly uncompatible dtype
-                sum_im = np.nansum(frames, axis=2)
+                sum_im = isum
             else:
-                sum_im += np.nansum(np.reshape(
-                    frames, (frames.shape[0], frames.shape[1],
-                             int(frames.size//(frames.shape[0] * frames.shape[1])))),
-                                    axis=2)
+                sum_im += isum
             
         progress.end()
         return sum_im
@@ -702,8 +972,8 @@ class HDFCube(orb.core.WCSData):
             fout.attrs['level3'] = True
             
             with self.open_hdf5() as f:
-                for iattr in f.attrs:
-                    fout.attrs[iattr] = f.attrs[iattr]
+                for iattr, ival in f.attrs.items():
+                    fout.attrs[iattr] = ival
 
                 # write datasets
                 for ikey in f:
@@ -713,10 +983,21 @@ class HDFCube(orb.core.WCSData):
                         if isinstance(ikeyval, np.ndarray):
                             ikeyval = orb.utils.io.cast_storing_dtype(ikeyval)
                         fout.create_dataset(ikey, data=ikeyval, chunks=True)
+                        # dataset attributes are needed to read some
+                        # datasets (e.g. packed_shape of the mask)
+                        for iattr, ival in f[ikey].attrs.items():
+                            fout[ikey].attrs[iattr] = ival
 
                 # write data
                 dtype = orb.utils.io.get_storing_dtype(self[0,0,0])
-                fout.create_dataset('data', shape=self.shape, dtype=dtype, chunks=True)
+
+                # stored chunks are copied as is (without decompression
+                # and type conversion) when possible
+                if self._copy_raw_chunks(f, fout, dtype): return
+                
+                fout.create_dataset(
+                    'data', shape=self.shape, dtype=dtype,
+                    **orb.utils.io.get_cube_dataset_kwargs(self.shape))
 
                 for iquad in range(quad_nb):
                     xmin, xmax, ymin, ymax = self.get_quadrant_dims(iquad, div_nb=div_nb)
@@ -731,6 +1012,46 @@ class HDFCube(orb.core.WCSData):
                     fout['data'][xmin:xmax, ymin:ymax, :] = data
 
 
+    def _copy_raw_chunks(self, f, fout, dtype):
+        """Copy the data dataset of the cube to another file chunk by
+        chunk. Chunks are copied as they are stored (possibly
+        compressed) and the new dataset is created with the same
+        creation properties (chunks, filters, fill value).
+
+        Only possible if the cube is not level 1, has no mask (which
+        must be applied to the data) and is chunked and stored with
+        the given type.
+
+        :param f: Opened cube file.
+
+        :param fout: Opened output file (must not contain a data
+          dataset).
+
+        :param dtype: Storing type of the output data.
+
+        :return: True if the data has been copied, False otherwise.
+        """
+        if self.is_level1() or 'mask' in f: return False
+        dset = f['data']
+        if dset.chunks is None or dset.dtype != np.dtype(dtype): return False
+        if not hasattr(dset.id, 'read_direct_chunk'): return False # h5py < 3
+
+        dsid = h5py.h5d.create(
+            fout.id, b'data', dset.id.get_type(),
+            h5py.h5s.create_simple(dset.shape),
+            dcpl=dset.id.get_create_plist())
+        
+        chunks = self._iter_chunks(dset)
+        logging.info('copying {} chunks'.format(len(chunks)))
+        progress = orb.core.ProgressBar(len(chunks))
+        for ichunk, info in enumerate(chunks):
+            filter_mask, blob = dset.id.read_direct_chunk(info.chunk_offset)
+            dsid.write_direct_chunk(info.chunk_offset, blob, filter_mask)
+            if not ichunk % 1000:
+                progress.update(ichunk, info='copying chunks')
+        progress.end()
+        return True
+    
     def crop(self, path, cx, cy, size):
         """Extract a part of the file and write it to a new hdf file
 
@@ -755,7 +1076,8 @@ class HDFCube(orb.core.WCSData):
         outcube = RWHDFCube(path, shape=(df.dimx, df.dimy, self.dimz),
                             instrument=self.instrument, reset=True, params=df.params)
         logging.info('writing cube')
-        data = self[xmin:xmax, ymin:ymax, :]
+        # data is written with its storing type
+        data = self._read_data(np.s_[xmin:xmax, ymin:ymax, :], upcast=False)
         outcube[:,:,:] = data
         logging.info('cropped cube written at {}'.format(path))
                 
@@ -804,7 +1126,8 @@ class HDFCube(orb.core.WCSData):
         progress = orb.core.ProgressBar(self.dimz)
         for iz in range(hdr['NAXIS3']):
             progress.update(iz, info='Exporting frame {}'.format(iz))
-            shdu.write(self[:,:,iz].real.astype(np.float32).T * flambda[iz])
+            shdu.write(self._read_data(np.s_[:,:,iz], upcast=False).real.astype(
+                np.float32).T * flambda[iz])
             #shdu.write(np.zeros((self.dimy, self.dimx), dtype=np.float32))
             
         progress.end()
@@ -818,8 +1141,50 @@ class HDFCube(orb.core.WCSData):
 
         :param index: Index of the frame
         """
-        return orb.utils.io.header_hdf52fits(
-            self.get_dataset('frame_header_{}'.format(index)))
+        with self.open_hdf5() as f:
+            return self._read_frame_header(f, index)
+
+    def has_frame_headers(self):
+        """Return True if frame headers are present"""
+        with self.open_hdf5() as f:
+            return 'frame_headers' in f or 'frame_header_0' in f
+
+    def get_frame_headers(self, start, stop):
+        """Return the headers of a range of frames.
+
+        The headers are returned as a list of pyfits.Header()
+        instances.
+
+        :param start: Index of the first frame
+
+        :param stop: Index of the last frame + 1
+        """
+        with self.open_hdf5() as f:
+            return [self._read_frame_header(f, index)
+                    for index in range(start, stop)]
+
+    def _read_frame_header(self, f, index):
+        """Read the header of a frame.
+
+        Headers are stored as FITS strings in the 'frame_headers'
+        dataset. Headers stored in a 'frame_header_{index}' dataset
+        (older cubes) are also read.
+
+        :param f: Opened HDF5 file.
+
+        :param index: Index of the frame
+        """
+        if 'frame_headers' in f:
+            header = f['frame_headers'][index]
+            if isinstance(header, bytes):
+                header = header.decode()
+            if header != '':
+                return astropy.io.fits.Header.fromstring(header)
+            
+        path = 'frame_header_{}'.format(index)
+        if path not in f:
+            raise AttributeError('{} dataset not in the hdf5 file'.format(path))
+        return orb.utils.io.header_hdf52fits(f[path][:])
     
     def get_calibration_laser_map(self, checkattr=True):
         """Return calibration laser map"""
@@ -1005,18 +1370,18 @@ class HDFCube(orb.core.WCSData):
         if self.has_param('airmass'):
             if np.size(self.params.airmass) == self.dimz:
                 return self.params.airmass
-            elif not self.has_dataset('frame_header_0'):
+            elif not self.has_frame_headers():
                 logging.debug('airmass size is {} but cube dimz is {}. no frame header present so the airmass is returned as is'.format(np.size(self.params.airmass), self.dimz))
                 return self.params.airmass
-        elif not self.has_dataset('frame_header_0'):
+        elif not self.has_frame_headers():
             raise Exception('airmass not set and no frame headers')
 
         airmass = list()
-        for i in range(self.dimz):
+        for i, iheader in enumerate(self.get_frame_headers(0, self.dimz)):
             try:
-                airmass.append(float(self.get_frame_header(i)['AIRMASS']))
+                airmass.append(float(iheader['AIRMASS']))
             except KeyError:
-                raise Exception('frame_header_{} not present'.format(i))
+                raise Exception('AIRMASS not present in frame header {}'.format(i))
         self.params['airmass'] = np.array(airmass)
         return self.params.airmass
 
@@ -1304,8 +1669,11 @@ class HDFCube(orb.core.WCSData):
 #### CLASS RWHDFCube ############################
 #################################################
 class RWHDFCube(HDFCube):
+
+    frame_buffer_size = 16 # number of frames buffered by write_frame
     
-    def __init__(self, path, shape=None, instrument=None, reset=False, dtype=np.float32, **kwargs):
+    def __init__(self, path, shape=None, instrument=None, reset=False, dtype=np.float32,
+                 compress=False, **kwargs):
         """:param path: Path to an HDF5 cube
 
         :param shape: (Optional) Must be set to something else than
@@ -1315,9 +1683,15 @@ class RWHDFCube(HDFCube):
         :param reset: (Optional) If True and if a file already exists,
           it is deleted before being created again.
 
+        :param compress: (Optional) If True and if a new file is
+          created, data is compressed with Blosc2. hdf5plugin must
+          be installed (default False).
+
         :param kwargs: (Optional) :py:class:`~orb.core.HDFCube` kwargs.
 
         """
+        self._pending_frames = dict() # frames buffered by write_frame
+        
         # reset
         if reset:
             if os.path.exists(path):
@@ -1331,8 +1705,10 @@ class RWHDFCube(HDFCube):
                 raise ValueError('cube does not exist. If you want to create one, shape must be set.')
             
             with orb.utils.io.open_hdf5(path, 'w') as f:
-                orb.utils.validate.has_len(shape, 3, object_name='shape')
-                f.create_dataset('data', shape=shape, chunks=True, dtype=dtype)
+                f.create_dataset(
+                    'data', shape=shape, dtype=dtype,
+                    **orb.utils.io.get_cube_dataset_kwargs(
+                        shape, compress=compress))
                 f.attrs['level3'] = True
                 f.attrs['instrument'] = instrument
                 f.attrs['program'] = 'ORB version {}'.format(orb.version.__version__)
@@ -1353,6 +1729,26 @@ class RWHDFCube(HDFCube):
             self.params['date'] = str(datetime.datetime.now())
             self.set_params(self.params)
 
+    def __del__(self):
+        """RWHDFCube destructor"""
+        self.close()
+
+    def __enter__(self):
+        """Enter the runtime context (frames buffered by
+        :py:meth:`write_frame` are written at exit)."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the runtime context: buffered frames are written and
+        the file is closed."""
+        self.close()
+
+    def close(self):
+        """Write the frames buffered by :py:meth:`write_frame` and
+        close the HDF5 file kept opened for reading."""
+        self.flush_frames()
+        super().close()
+        
     def __setitem__(self, key, value):
         """Implement setitem special method"""        
         # decrease representation in case of complex or floats to
@@ -1376,6 +1772,84 @@ class RWHDFCube(HDFCube):
                 value = value.astype(f['data'].dtype)
             f['data'].__setitem__(key, value)
 
+    def _get_hdf5f(self):
+        """Return the HDF5 file opened in read mode (see
+        :py:meth:`HDFCube._get_hdf5f`). Frames buffered by
+        :py:meth:`write_frame` are written before.
+        """
+        self.flush_frames()
+        return super()._get_hdf5f()
+    
+    def open_hdf5(self, mode='r'):
+        """Return a handle on the hdf5 file. Frames buffered by
+        :py:meth:`write_frame` are written before.
+
+        :param mode: opening mode. can be 'r' or 'a'. 
+        """
+        self.flush_frames()
+        return super().open_hdf5(mode=mode)
+
+    def flush_frames(self):
+        """Write the frames buffered by :py:meth:`write_frame`.
+
+        Consecutive frames are written at once.
+        """
+        if len(self._pending_frames) == 0: return
+        # buffer is emptied first since writing data opens the file
+        pending = self._pending_frames
+        self._pending_frames = dict()
+        
+        indexes = sorted(pending)
+
+        # frames are written chunk by chunk, bypassing HDF5 type
+        # conversion and filter pipeline, when the data is not
+        # filtered and each chunk is a tile of a single frame. Filters
+        # are counted on the creation property list since third-party
+        # filters (e.g. Blosc2) are not reported by dset.compression.
+        with super().open_hdf5('a') as f:
+            dset = f['data']
+            if (dset.chunks is not None and dset.chunks[2] == 1
+                and dset.id.get_create_plist().get_nfilters() == 0
+                and np.all([pending[i].dtype == dset.dtype for i in indexes])):
+                for index in indexes:
+                    self._write_frame_chunks(dset, index, pending[index])
+                return
+        
+        run_start = 0
+        for i in range(1, len(indexes) + 1):
+            if i < len(indexes) and indexes[i] == indexes[i-1] + 1:
+                continue
+            run = indexes[run_start:i]
+            self[:, :, run[0]:run[-1] + 1] = np.stack(
+                [pending[irun] for irun in run], axis=-1)
+            run_start = i
+
+    def _write_frame_chunks(self, dset, index, frame):
+        """Write a frame directly chunk by chunk in the data dataset.
+
+        The dataset must not be filtered and its chunks must have a
+        size of 1 along z. Incomplete chunks at the edges of the
+        frame are padded with zeros.
+
+        :param dset: data dataset
+
+        :param index: Index of the frame
+
+        :param frame: Frame data. Must have the dtype of the dataset.
+        """
+        cx, cy = dset.chunks[:2]
+        tile = np.zeros((cx, cy), dtype=dset.dtype)
+        for ix in range(0, self.dimx, cx):
+            for iy in range(0, self.dimy, cy):
+                ichunk = frame[ix:ix+cx, iy:iy+cy]
+                if ichunk.shape == (cx, cy):
+                    ichunk = np.ascontiguousarray(ichunk)
+                else:
+                    tile.fill(0)
+                    tile[:ichunk.shape[0], :ichunk.shape[1]] = ichunk
+                    ichunk = tile
+                dset.id.write_direct_chunk((ix, iy, index), ichunk.tobytes())
+
     def set_param(self, key, value):
         """Set class parameter
 
@@ -1383,6 +1857,10 @@ class RWHDFCube(HDFCube):
 
         :param value: parameter value
         """
+        if key == 'format_version':
+            # only set when a newer layout is written (see
+            # _set_format_version)
+            return
         self.params[key] = value
         with self.open_hdf5('a') as f:
             _update = True
@@ -1410,6 +1888,20 @@ class RWHDFCube(HDFCube):
             except TypeError:
                 logging.warning('error setting param {}'.format(ipar))
 
+    def _set_format_version(self, f, version):
+        """Set the file format version of the cube (see
+        CUBE_FORMAT_VERSION). Must be called before writing data with
+        the layout of a given version. The version of a file is never
+        lowered.
+
+        :param f: HDF5 file opened in write mode.
+
+        :param version: File format version of the written layout.
+        """
+        if int(f.attrs.get('format_version', 1)) < version:
+            f.attrs['format_version'] = version
+            self.params['format_version'] = version
+
     def set_mask(self, data):
         """Set mask
 
@@ -1418,9 +1910,18 @@ class RWHDFCube(HDFCube):
         which should be masked (Nans are returned for this pixel).
 
         :param data: mask. Must be a boolean array
+
+        .. note:: The mask is stored with 1 bit per pixel (file format
+          version 3, see CUBE_FORMAT_VERSION). Older versions of ORB
+          cannot read it.
         """
         HDFCube.set_mask(self, data)
-        self.set_dataset('mask', data, protect=False)
+        data = np.asarray(data, dtype=bool)
+        with self.open_hdf5('a') as f:
+            self._set_format_version(f, 3)
+        self.set_dataset('mask', np.packbits(data, axis=-1), protect=False)
+        with self.open_hdf5('a') as f:
+            f['mask'].attrs['packed_shape'] = data.shape
             
     def set_dataset(self, path, data, protect=True):
         """Write a dataset to the hdf5 file
@@ -1438,13 +1939,21 @@ class RWHDFCube(HDFCube):
 
         if path == 'data':
             raise ValueError('to set data please use your cube as a classic 3d numpy array. e.g. cube[:,:,:] = value.')
+        if isinstance(data, dict):
+            data = orb.utils.io.dict2array(data)
+        data = np.asarray(data)
+        
         with self.open_hdf5('a') as f:
             if path in f:
-                del f[path]
                 logging.warning('{} dataset changed'.format(path))
-
-            if isinstance(data, dict):
-                data = orb.utils.io.dict2array(data)
+                dset = f[path]
+                # overwritten in place if possible, deleting a dataset
+                # does not free its space in the file
+                if (isinstance(dset, h5py.Dataset)
+                    and dset.shape == data.shape and dset.dtype == data.dtype):
+                    dset[...] = data
+                    return
+                del f[path]
 
             f.create_dataset(path, data=data, chunks=True)
 
@@ -1468,9 +1977,22 @@ class RWHDFCube(HDFCube):
         :param index: Index of the frame
 
         :param header: Header as a pyfits.Header instance.
+
+        .. note:: All the headers are stored as FITS strings in a
+          single 'frame_headers' dataset (file format version 2, see
+          CUBE_FORMAT_VERSION). Older versions of ORB cannot read
+          these headers.
         """
-        self.set_dataset('frame_header_{}'.format(index),
-                         orb.utils.io.header_fits2hdf5(header))
+        with self.open_hdf5('a') as f:
+            self._set_format_version(f, 2)
+            if 'frame_headers' not in f:
+                f.create_dataset('frame_headers', shape=(self.dimz,),
+                                 dtype=h5py.string_dtype(encoding='ascii'))
+            f['frame_headers'][index] = header.tostring()
+
+            # remove header stored with the older format
+            if 'frame_header_{}'.format(index) in f:
+                del f['frame_header_{}'.format(index)]
 
     def set_calibration_laser_map(self, calib_map):
         """Set calibration map.
@@ -1585,6 +2107,20 @@ class RWHDFCube(HDFCube):
         This function is here for backward compatibility but a simple
         self[:,:,index] may be used instead.
 
+        .. note:: Full frames are buffered and written by batch of
+          :py:attr:`frame_buffer_size` frames. The buffer is written
+          before any other access to the file through this object.
+          Callers must call :py:meth:`flush_frames` or
+          :py:meth:`close` (or use the cube in a ``with`` block) once
+          the frames are written, since the last frames are
+          otherwise only written when the object is garbage
+          collected, and may be lost if an exception is raised in
+          the writing loop::
+
+            with RWHDFCube(path, shape=shape) as cube:
+                for iframe in range(shape[2]):
+                    cube.write_frame(iframe, data=frames[iframe])
+
         :param index: Index of the frame
         
         :param data: (Optional) Frame data (default None).
@@ -1605,13 +2141,27 @@ class RWHDFCube(HDFCube):
             xmin, xmax, ymin, ymax = 0, self.dimx, 0, self.dimy
 
         if data is not None:
-            self[xmin:xmax, ymin:ymax, index] = data
+            data = np.asarray(data)
+            if section is None and data.shape == (self.dimx, self.dimy):
+                # full frames are buffered and written by batch
+                self._pending_frames[index] = orb.utils.io.cast_storing_dtype(data)
+                if len(self._pending_frames) >= self.frame_buffer_size:
+                    self.flush_frames()
+            else:
+                self[xmin:xmax, ymin:ymax, index] = data
 
         if record_stats:
             if header is None:
-                header = dict()
-            header['MEAN'] = np.nanmean(self[xmin:xmax, ymin:ymax, index].real)
-            header['MEDIAN'] = np.nanmedian(self[xmin:xmax, ymin:ymax, index].real)
+                header = astropy.io.fits.Header()
+            else:
+                header = header.copy()
+            # written data is not read back from the file
+            if data is not None and data.shape == (xmax - xmin, ymax - ymin):
+                frame = data.real
+            else:
+                frame = self[xmin:xmax, ymin:ymax, index].real
+            header['MEAN'] = (float(np.nanmean(frame)), 'Mean of data (NaNs filtered)')
+            header['MEDIAN'] = (float(np.nanmedian(frame)), 'Median of data (NaNs filtered)')
                         
         if header is not None:
             self.set_frame_header(index, header)
@@ -216,11 +216,13 @@ class Interferogram(orb.core.Vector1d):
 
         .. note:: no phase correction is made here.
         """
-        if np.any(np.isnan(self.data)):
+        # the sum is NaN if there is any NaN (or +inf and -inf) in the
+        # data: a single pass without any temporary array
+        if np.isnan(np.sum(self.data)) and np.any(np.isnan(self.data)):
             logging.debug('Nan detected in interferogram')
             return orb.core.Vector1d(np.zeros(
                 self.dimx, dtype=self.data.dtype) * np.nan)
-        if len(np.nonzero(self.data)[0]) == 0:
+        if not np.any(self.data):
             logging.debug('interferogram is filled with zeros')
             return orb.core.Vector1d(np.zeros(
                 self.dimx, dtype=self.data.dtype))
@@ -241,7 +243,7 @@ class Interferogram(orb.core.Vector1d):
         if self.has_params():
             axis = orb.core.Axis(orb.utils.spectrum.create_cm1_axis(
                 self.dimx, self.params.step, self.params.order,
-                corr=self.params.calib_coeff))
+                corr=self.params.calib_coeff), _trusted=True)
 
         else:
             axis_step = (self.dimx - 1) / 2. / self.dimx
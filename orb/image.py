@@ -222,8 +222,7 @@ class Image(Frame2D):
         :param data: (Optional) can be used to change data
         """
         return Frame2D.copy(self, data=data, instrument=self.instrument,
-                            config=self.config, data_prefix=self._data_prefix,
-                            sip=self.get_wcs())
+                            config=self.config, data_prefix=self._data_prefix)
     
 
     def detrend(self, bias=None, dark=None, flat=None, shift=None, cr_map=None):
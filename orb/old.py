@@ -17,13 +17,11 @@ import select
 import socket
 
 import numpy as np
+import h5py
 import astropy.io.fits as pyfits
 import astropy.wcs as pywcs
 from scipy import interpolate
 
-try: import pygit2
-except ImportError: pass
-
 ## MODULES IMPORTS
 import orb.utils.spectrum
 import orb.utils.parallel
@@ -218,23 +216,30 @@ class Cube(orb.core.Tools):
         self._return_mask = False
         return data
         
-    def get_mean_image(self, recompute=False):
+    def get_mean_image(self, recompute=False, step_size=100):
         """Return the mean image of a cube (corresponding to a deep
         frame for an interferogram cube or a specral cube).
 
         :param recompute: (Optional) Force to recompute mean image
           even if it is already present in the cube (default False).
+
+        :param step_size: (Optional) Number of frames read at once
+          (default 100).
         
         .. note:: In this process NaNs are considered as zeros.
         """
         if self.mean_image is None or recompute:
             mean_im = np.zeros((self.dimx, self.dimy), dtype=self.dtype)
             progress = ProgressBar(self.dimz)
-            for _ik in range(self.dimz):
-                frame = self[:,:,_ik]
-                non_nans = np.nonzero(~np.isnan(frame))
-                mean_im[non_nans] += frame[non_nans]
-                progress.update(_ik, info="Creating mean image")
+            silent_load = self._silent_load
+            self._silent_load = True
+            for ik in range(0, self.dimz, step_size):
+                progress.update(ik, info="Creating mean image")
+                frames = self[:,:,ik:min(ik + step_size, self.dimz)]
+                mean_im += np.nansum(np.reshape(
+                    frames, (self.dimx, self.dimy, -1)), axis=2,
+                                     dtype=self.dtype)
+            self._silent_load = silent_load
             progress.end()
             self.mean_image = mean_im / self.dimz
         return self.mean_image            
@@ -299,6 +304,9 @@ class HDFCube(Cube):
         Cube.__init__(self, None, **kwargs)
             
         self._hdf5f = None # Instance of h5py.File
+        self._dset_cache = dict() # opened datasets of self._hdf5f
+        self._mm = None # memory map of the whole cube file
+        self._frame_mm = dict() # memory-mapped frames
         self.quad_nb = None # number of quads (set to None if HDFCube
                             # is not a cube split in quads but a cube
                             # split in frames)
@@ -318,16 +326,20 @@ class HDFCube(Cube):
 
         if cube_path is None or cube_path == '': return
         
-        with orb.utils.io.open_hdf5(cube_path, 'r') as f:
+        with orb.utils.io.open_hdf5(
+                cube_path, 'r', large_cache=True) as f:
             self.cube_path = cube_path
-            self.dimz = self._get_attribute('dimz')
-            self.dimx = self._get_attribute('dimx')
-            self.dimy = self._get_attribute('dimy')
+            # all attributes are read at once
+            attrs = dict(f.attrs)
+            self.dimz = self._get_attribute('dimz', attrs=attrs)
+            self.dimx = self._get_attribute('dimx', attrs=attrs)
+            self.dimy = self._get_attribute('dimy', attrs=attrs)
             if 'image_list' in f:
                 self.image_list = f['image_list'][:]
             
             # check if cube is quad or frames based
-            self.quad_nb = self._get_attribute('quad_nb', optional=True)
+            self.quad_nb = self._get_attribute(
+                'quad_nb', optional=True, attrs=attrs)
             if self.quad_nb is not None:
                 self.is_quad_cube = True
             else:
@@ -335,9 +347,7 @@ class HDFCube(Cube):
         
             # sanity check
             if self.is_quad_cube:
-                quad_nb = len(
-                    [igrp for igrp in f
-                     if 'quad' == igrp[:4]])
+                quad_nb = sum(1 for igrp in f if igrp.startswith('quad'))
                 if quad_nb != self.quad_nb:
                     raise Exception("Corrupted HDF5 cube: 'quad_nb' attribute ([]) does not correspond to the real number of quads ({})".format(self.quad_nb, quad_nb))
 
@@ -356,26 +366,29 @@ class HDFCube(Cube):
                     
 
             else:
-                frame_nb = len(
-                    [igrp for igrp in f
-                     if 'frame' == igrp[:5]])
+                frame_nb = sum(1 for igrp in f if igrp.startswith('frame'))
 
                 if frame_nb != self.dimz:
                     raise Exception("Corrupted HDF5 cube: 'dimz' attribute ({}) does not correspond to the real number of frames ({})".format(self.dimz, frame_nb))
                 
             
-                if self._get_hdf5_frame_path(0) in f:                
-                    if ((self.dimx, self.dimy)
-                        != f[self._get_hdf5_data_path(0)].shape):
-                        raise Exception('Corrupted HDF5 cube: frame shape {} does not correspond to the attributes of the file {}x{}'.format(f[self._get_hdf5_data_path(0)].shape, self.dimx, self.dimy))
+                frame0_path = self._get_hdf5_frame_path(0)
+                if frame0_path in f:
+                    # first frame dataset is opened only once
+                    data0 = f[self._get_hdf5_data_path(0)]
+                    if (self.dimx, self.dimy) != data0.shape:
+                        raise Exception('Corrupted HDF5 cube: frame shape {} does not correspond to the attributes of the file {}x{}'.format(data0.shape, self.dimx, self.dimy))
 
                     if self._get_hdf5_data_path(0, mask=True) in f:
                         self._mask_exists = True
                     else:
                         self._mask_exists = False
 
+                    # frames are read with their storing dtype
+                    self._read_dtype = data0.dtype
+
                     # test whether data is complex
-                    if np.iscomplexobj(f[self._get_hdf5_data_path(0)]):
+                    if np.iscomplexobj(data0):
                         self.is_complex = True
                         self.dtype = complex
                     else:
@@ -383,7 +396,7 @@ class HDFCube(Cube):
                         self.dtype = float
                 else:
                     raise Exception('{} is missing. A valid HDF5 cube must contain at least one frame'.format(
-                        self._get_hdf5_frame_path(0)))
+                        frame0_path))
                 
 
         # binning
@@ -428,9 +441,16 @@ class HDFCube(Cube):
         y_slice = self._get_default_slice(key[1], self.dimy)
         z_slice = self._get_default_slice(key[2], self.dimz)
 
+        # frames are read with their storing dtype (generally float32)
+        # to avoid an upcast at each read. Binned data is float.
+        if (not self.is_quad_cube and self._prebinning is None
+            and not self._return_mask):
+            dtype = self._read_dtype
+        else:
+            dtype = self.dtype
         data = np.empty((x_slice.stop - x_slice.start,
                          y_slice.stop - y_slice.start,
-                         z_slice.stop - z_slice.start), dtype=self.dtype)
+                         z_slice.stop - z_slice.start), dtype=dtype)
 
         if self._prebinning is not None:
             x_slice = slice(x_slice.start * self._prebinning,
@@ -446,35 +466,53 @@ class HDFCube(Cube):
             else:
                 only_one_frame = False
 
-            with orb.utils.io.open_hdf5(self.cube_path, 'r') as f:
-                if not self._silent_load and not only_one_frame:
-                    progress = ProgressBar(z_slice.stop - z_slice.start - 1)
-
-                for ik in range(z_slice.start, z_slice.stop):
-                    unbin_data = f[
-                        self._get_hdf5_data_path(
-                            ik, mask=self._return_mask)][x_slice, y_slice]
-
-                    if self._prebinning is not None:
-                        data[0:x_slice.stop - x_slice.start,
-                             0:y_slice.stop - y_slice.start,
-                             ik - z_slice.start] = orb.utils.image.nanbin_image(
-                            unbin_data, self._prebinning)
-                    else:
-                        data[0:x_slice.stop - x_slice.start,
-                             0:y_slice.stop - y_slice.start,
-                             ik - z_slice.start] = unbin_data
-
-                    if not self._silent_load and not only_one_frame:
-                        if not ik%100:
-                            progress.update(ik - z_slice.start, info="Loading data")
+            f = self._get_hdf5f()
+            if not self._silent_load and not only_one_frame:
+                progress = ProgressBar(z_slice.stop - z_slice.start - 1)
+
+            # when whole frames are read no hyperslab selection is
+            # needed on the source
+            full_xy = (x_slice.start == 0 and y_slice.start == 0
+                       and (x_slice.stop, y_slice.stop) == self._get_dset(
+                           f, z_slice.start, mask=self._return_mask).shape)
+            if full_xy: source_sel = None
+            else: source_sel = np.s_[x_slice, y_slice]
+            
+            for ik in range(z_slice.start, z_slice.stop):
+                dset = self._get_dset(f, ik, mask=self._return_mask)
+                frame_mm = self._get_frame_memmap(
+                    f, ik, mask=self._return_mask)
+                
+                if self._prebinning is not None:
+                    if frame_mm is not None:
+                        unbin_data = frame_mm[x_slice, y_slice]
+                    elif full_xy: unbin_data = dset[()]
+                    else: unbin_data = dset[x_slice, y_slice]
+                    data[0:x_slice.stop - x_slice.start,
+                         0:y_slice.stop - y_slice.start,
+                         ik - z_slice.start] = orb.utils.image.nanbin_image(
+                        unbin_data, self._prebinning)
+                elif frame_mm is not None:
+                    data[0:x_slice.stop - x_slice.start,
+                         0:y_slice.stop - y_slice.start,
+                         ik - z_slice.start] = frame_mm[x_slice, y_slice]
+                else:
+                    # read directly into the output buffer to
+                    # avoid a temporary array per frame
+                    dset.read_direct(
+                        data, source_sel=source_sel,
+                        dest_sel=np.s_[:, :, ik - z_slice.start])
 
                 if not self._silent_load and not only_one_frame:
-                    progress.end()
+                    progress.update(ik - z_slice.start, info="Loading data")
+
+            if not self._silent_load and not only_one_frame:
+                progress.end()
 
         # quad based cube
         else:
-            with orb.utils.io.open_hdf5(self.cube_path, 'r') as f:
+            with orb.utils.io.open_hdf5(
+                self.cube_path, 'r', large_cache=True) as f:
                 if not self._silent_load:
                     progress = ProgressBar(self.quad_nb)
                 for iquad in range(self.quad_nb):
@@ -497,7 +535,88 @@ class HDFCube(Cube):
 
         return np.squeeze(data)
 
-    def _get_attribute(self, attr, optional=False):
+    def _get_hdf5f(self):
+        """Return the HDF5 file opened in read mode.
+
+        The file is opened at the first call and kept open until
+        :py:meth:`close` is called.
+        """
+        if self._hdf5f is None:
+            self._hdf5f = orb.utils.io.open_hdf5(
+                self.cube_path, 'r', large_cache=True)
+        return self._hdf5f
+
+    def _get_dset(self, f, frame_index, mask=False):
+        """Return the dataset of a given frame. Opened datasets are
+        cached.
+
+        :param f: Opened HDF5 file (returned by
+          :py:meth:`_get_hdf5f`).
+
+        :param frame_index: Index of the frame
+        
+        :param mask: (Optional) If True, the masked frame is
+          returned (default False).
+        """
+        key = (frame_index, mask)
+        if key not in self._dset_cache:
+            self._dset_cache[key] = f[self._get_hdf5_data_path(
+                frame_index, mask=mask)]
+        return self._dset_cache[key]
+
+    def _get_frame_memmap(self, f, frame_index, mask=False):
+        """Return a memory map of a given frame or None if the frame
+        cannot be memory-mapped.
+
+        Only frames stored contiguously (i.e. not chunked nor
+        compressed) in the file can be memory-mapped.
+
+        :param f: Opened HDF5 file (returned by
+          :py:meth:`_get_hdf5f`).
+
+        :param frame_index: Index of the frame
+        
+        :param mask: (Optional) If True, the masked frame is
+          returned (default False).
+        """
+        key = (frame_index, mask)
+        if key not in self._frame_mm:
+            dset = self._get_dset(f, frame_index, mask=mask)
+            offset = dset.id.get_offset()
+            if (offset is None or dset.id.get_create_plist().get_layout()
+                != h5py.h5d.CONTIGUOUS):
+                self._frame_mm[key] = None
+            else:
+                if self._mm is None:
+                    self._mm = np.memmap(self.cube_path, dtype=np.uint8,
+                                         mode='r')
+                nbytes = dset.size * dset.dtype.itemsize
+                self._frame_mm[key] = self._mm[
+                    offset:offset + nbytes].view(dset.dtype).reshape(
+                        dset.shape)
+        return self._frame_mm[key]
+
+    def __getstate__(self):
+        """Used to pickle object (the opened file, datasets and
+        memory maps are not pickled)"""
+        state = self.__dict__.copy()
+        state['_hdf5f'] = None
+        state['_dset_cache'] = dict()
+        state['_mm'] = None
+        state['_frame_mm'] = dict()
+        return state
+
+    def close(self):
+        """Close the HDF5 file and clear the cache of opened
+        datasets."""
+        self._dset_cache = dict()
+        self._frame_mm = dict()
+        self._mm = None
+        if self._hdf5f is not None:
+            self._hdf5f.close()
+            self._hdf5f = None
+
+    def _get_attribute(self, attr, optional=False, attrs=None):
         """Return the value of an attribute of the HDF5 cube
 
         :param attr: Attribute to return
@@ -505,14 +624,23 @@ class HDFCube(Cube):
         :param optional: If True and if the attribute does not exist
           only a warning is raised. If False the HDF5 cube is
           considered as invalid and an exception is raised.
+
+        :param attrs: (Optional) A dict of the already read
+          attributes of the cube. If None, attributes are read from
+          the file (default None).
         """
-        with orb.utils.io.open_hdf5(self.cube_path, 'r') as f:
-            if attr in f.attrs:
-                return f.attrs[attr]
+        if attrs is None:
+            with orb.utils.io.open_hdf5(
+                self.cube_path, 'r', large_cache=True) as f:
+                return self._get_attribute(attr, optional=optional,
+                                           attrs=f.attrs)
+                
+        if attr in attrs:
+            return attrs[attr]
+        else:
+            if not optional:
+                raise Exception('Attribute {} is missing. The HDF5 cube seems badly formatted. Try to create it again with the last version of ORB.'.format(attr))
             else:
-                if not optional:
-                    raise Exception('Attribute {} is missing. The HDF5 cube seems badly formatted. Try to create it again with the last version of ORB.'.format(attr))
-                else:
-                    return None
+                return None
                    
 
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# *-* coding: utf-8 *-*
+# Author: Thomas Martin <thomas.martin.1@ulaval.ca>
+# File: test_core.py
+
+## Copyright (c) 2010-2020 Thomas Martin <thomas.martin.1@ulaval.ca>
+## 
+## This file is part of ORB
+##
+## ORB is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## ORB is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+## or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+## License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with ORB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Regression tests of orb.core"""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import numpy as np
+
+import orb.core
+
+
+class TestStandardTable(unittest.TestCase):
+
+    def setUp(self):
+        self.tools = orb.core.Tools()
+
+    def test_standard_list(self):
+        std_list = self.tools._get_standard_list()
+        self.assertIn('HZ44', std_list)
+        self.assertEqual(std_list, sorted(set(std_list)))
+        for group in ['MASSEY', 'MISC', 'CALSPEC', 'OKE']:
+            self.assertTrue(set(self.tools._get_standard_list(group=group))
+                            <= set(std_list))
+        with self.assertRaises(Exception):
+            self.tools._get_standard_list(group='NOTAGROUP')
+
+    def test_file_path(self):
+        path, group = self.tools._get_standard_file_path('HZ4')
+        self.assertEqual(group, 'CALSPEC')
+        self.assertEqual(os.path.basename(path), 'hz4_stis_002.fits')
+        self.assertTrue(os.path.exists(path))
+        
+    def test_unknown_standard(self):
+        with self.assertRaises(Exception):
+            self.tools._get_standard_file_path('NOTASTANDARD')
+
+    def test_radec_from_table(self):
+        with unittest.mock.patch('orb.utils.web.query_sesame', return_value=[]):
+            ra, dec, pm_ra, pm_dec = self.tools._get_standard_radec(
+                'HZ44', return_pm=True)
+            self.assertEqual(self.tools._get_standard_radec('HZ44'), (ra, dec))
+        self.assertEqual((ra, dec, pm_ra, pm_dec),
+                         (200.89690875, 36.13319833, -61.6, -3.1))
+        self.assertIsInstance(ra, float)
+
+    def test_standard_in_several_groups(self):
+        for group in ['MASSEY', 'CALSPEC', 'OKE']:
+            self.assertIn('HZ44', self.tools._get_standard_list(group=group))
+        for group in ['CALSPEC', 'OKE']:
+            self.assertIn('G191B2B', self.tools._get_standard_list(group=group))
+            self.assertIn('HD93521', self.tools._get_standard_list(group=group))
+        
+    def test_file_path_falls_back_to_next_entry(self):
+        # the MASSEY spectrum of HZ44 (first entry) is not shipped
+        path, group = self.tools._get_standard_file_path('HZ44')
+        self.assertEqual(group, 'CALSPEC')
+        self.assertEqual(os.path.basename(path), 'hz44_stis_001.fits')
+        self.assertTrue(os.path.exists(path))
+
+
+class TestParamsFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_path(self, file_name):
+        return os.path.join(self.tmpdir.name, file_name)
+
+    def read(self, path):
+        pfile = orb.core.ParamsFile(path, reset=False)
+        params_list = pfile.get_data()
+        pfile.close()
+        return params_list
+    
+    def test_extend(self):
+        params_list = [{'x': i, 'y': i / 3., 'flux': i * 1e-20}
+                       for i in range(50)]
+        path = self.get_path('extend.txt')
+        pfile = orb.core.ParamsFile(path)
+        pfile.extend(params_list)
+        self.assertEqual(pfile.get_data(), params_list)
+        pfile.close()
+
+        read_list = self.read(path)
+        self.assertEqual(len(read_list), len(params_list))
+        for iread, iparams in zip(read_list, params_list):
+            for ikey in iparams:
+                self.assertEqual(float(iread[ikey]), iparams[ikey])
+
+    def test_extend_after_append(self):
+        path = self.get_path('mixed.txt')
+        pfile = orb.core.ParamsFile(path)
+        pfile.append({'a': 0, 'b': 'star0'})
+        pfile.extend([{'a': i, 'b': 'star{}'.format(i)} for i in range(1, 10)])
+        pfile.close()
+        
+        read_list = self.read(path)
+        self.assertEqual([iread['b'] for iread in read_list],
+                         ['star{}'.format(i) for i in range(10)])
+        
+    def test_extend_checks_keys(self):
+        pfile = orb.core.ParamsFile(self.get_path('keys.txt'))
+        with self.assertRaises(Exception):
+            pfile.extend([{'a': 1}, {'b': 2}])
+        pfile.close()
+
+    def write(self, file_name, params_list, use_extend):
+        path = self.get_path(file_name)
+        pfile = orb.core.ParamsFile(path)
+        if use_extend:
+            pfile.extend(params_list)
+        else:
+            for params in params_list:
+                pfile.append(params)
+        pfile.close()
+        with open(path, 'r') as f:
+            return f.read()
+
+    def test_extend_formats_like_append(self):
+        params_list = list()
+        for i in range(50):
+            params_list.append({
+                'x': i, 'y': i / 3., 'flux': np.float32(i) * 1e-20,
+                'snr': np.nan if i % 7 == 0 else float(i) ** 0.5,
+                'flag': bool(i % 2)})
+
+        self.assertEqual(
+            self.write('append.txt', params_list, False),
+            self.write('extend.txt', params_list, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+# *-* coding: utf-8 *-*
+# Author: Thomas Martin <thomas.martin.1@ulaval.ca>
+# File: test_cube.py
+
+## Copyright (c) 2010-2020 Thomas Martin <thomas.martin.1@ulaval.ca>
+## 
+## This file is part of ORB
+##
+## ORB is free software: you can redistribute it and/or modify it
+## under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## ORB is distributed in the hope that it will be useful, but WITHOUT
+## ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+## or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+## License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with ORB.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Regression tests of orb.cube"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import h5py
+import dill
+import astropy.io.fits
+import scipy.interpolate
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+import orb.cube
+import orb.old
+import orb.utils.io
+
+INSTRUMENT = 'sitelle'
+
+class CubeTestCase(unittest.TestCase):
+
+    # not a multiple of the chunk size (512) to get partial chunks,
+    # with the same binning along x and y
+    shape = (520, 520, 20)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.frames = np.random.default_rng(0).standard_normal(
+            self.shape).astype(np.float32)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_path(self, file_name):
+        return os.path.join(self.tmpdir.name, file_name)
+
+    def read_data(self, path):
+        with h5py.File(path, 'r') as f:
+            return f['data'][:]
+
+
+class TestWriteFrame(CubeTestCase):
+
+    def test_flush_frames(self):
+        path = self.get_path('flush.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        # fewer frames than the buffer size: nothing is written before
+        # flush_frames
+        for iframe in range(3):
+            cube.write_frame(iframe, data=self.frames[:,:,iframe])
+        np.testing.assert_array_equal(self.read_data(path), 0)
+        cube.flush_frames()
+        
+        data = self.read_data(path)
+        np.testing.assert_array_equal(data[:,:,:3], self.frames[:,:,:3])
+        np.testing.assert_array_equal(data[:,:,3:], 0)
+
+    def test_full_buffer_is_written(self):
+        path = self.get_path('full.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        nframes = cube.frame_buffer_size + 1
+        for iframe in range(nframes):
+            cube.write_frame(iframe, data=self.frames[:,:,iframe])
+        data = self.read_data(path)
+        np.testing.assert_array_equal(
+            data[:,:,:nframes - 1], self.frames[:,:,:nframes - 1])
+        np.testing.assert_array_equal(data[:,:,nframes - 1], 0)
+        
+        cube.flush_frames()
+        np.testing.assert_array_equal(
+            self.read_data(path)[:,:,:nframes], self.frames[:,:,:nframes])
+
+    def test_unordered_frames(self):
+        path = self.get_path('unordered.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        indexes = [5, 1, 2, 9, 3]
+        for iframe in indexes:
+            # float64 frames are stored as float32
+            cube.write_frame(iframe, data=self.frames[:,:,iframe].astype(float))
+        cube.flush_frames()
+        
+        data = self.read_data(path)
+        for iframe in range(self.shape[2]):
+            if iframe in indexes:
+                np.testing.assert_array_equal(
+                    data[:,:,iframe], self.frames[:,:,iframe])
+            else:
+                np.testing.assert_array_equal(data[:,:,iframe], 0)
+
+    def test_read_after_write_frame(self):
+        path = self.get_path('read.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT,
+                                  upcast=False)
+        # the file is kept opened for reading before the frame is buffered
+        np.testing.assert_array_equal(cube[:,:,1], 0)
+        cube.write_frame(1, data=self.frames[:,:,1])
+        np.testing.assert_array_equal(cube[:,:,1], self.frames[:,:,1])
+        np.testing.assert_array_equal(
+            cube.get_frames([1])[:,:,0], self.frames[:,:,1])
+        cube.close()
+
+    def test_close_writes_buffered_frames(self):
+        path = self.get_path('close.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        for iframe in range(3):
+            cube.write_frame(iframe, data=self.frames[:,:,iframe])
+        cube.close()
+        
+        data = self.read_data(path)
+        np.testing.assert_array_equal(data[:,:,:3], self.frames[:,:,:3])
+        np.testing.assert_array_equal(data[:,:,3:], 0)
+
+    def test_with_block_writes_buffered_frames(self):
+        path = self.get_path('with.hdf5')
+        with orb.cube.RWHDFCube(path, shape=self.shape,
+                                instrument=INSTRUMENT) as cube:
+            for iframe in range(self.shape[2]):
+                cube.write_frame(iframe, data=self.frames[:,:,iframe])
+
+        np.testing.assert_array_equal(self.read_data(path), self.frames)
+
+
+class TestRawChunks(CubeTestCase):
+
+    def write_frames(self, cube):
+        for iframe in range(self.shape[2]):
+            cube.write_frame(iframe, data=self.frames[:,:,iframe])
+        cube.flush_frames()
+
+    def get_filters(self, path):
+        with h5py.File(path, 'r') as f:
+            dcpl = f['data'].id.get_create_plist()
+            return [dcpl.get_filter(i)[0] for i in range(dcpl.get_nfilters())]
+        
+    def test_write_frame(self):
+        path = self.get_path('raw.hdf5')
+        self.write_frames(orb.cube.RWHDFCube(
+            path, shape=self.shape, instrument=INSTRUMENT))
+        with h5py.File(path, 'r') as f:
+            self.assertEqual(f['data'].chunks, (512, 512, 1))
+        self.assertEqual(self.get_filters(path), [])
+        np.testing.assert_array_equal(self.read_data(path), self.frames)
+
+    def test_write_frame_gzip(self):
+        path = self.get_path('gzip.hdf5')
+        with orb.utils.io.open_hdf5(path, 'w') as f:
+            f.create_dataset('data', shape=self.shape, dtype=np.float32,
+                             chunks=(512, self.shape[1], 1),
+                             compression='gzip', shuffle=True)
+            f.attrs['level3'] = True
+            f.attrs['instrument'] = INSTRUMENT
+        self.write_frames(orb.cube.RWHDFCube(path, instrument=INSTRUMENT))
+        np.testing.assert_array_equal(self.read_data(path), self.frames)
+
+    @unittest.skipIf(hdf5plugin is None, 'hdf5plugin is not installed')
+    def test_write_frame_blosc2(self):
+        # Blosc2 is not reported by h5py.Dataset.compression
+        path = self.get_path('blosc2.hdf5')
+        self.write_frames(orb.cube.RWHDFCube(
+            path, shape=self.shape, instrument=INSTRUMENT, compress=True))
+        self.assertEqual(self.get_filters(path), [hdf5plugin.Blosc2.filter_id])
+        np.testing.assert_array_equal(self.read_data(path), self.frames)
+
+    def check_writeto(self, compress):
+        path = self.get_path('in.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT,
+                                  compress=compress)
+        cube[:,:,:] = self.frames
+        out_path = self.get_path('out.hdf5')
+        cube.writeto(out_path)
+        cube.close()
+        
+        self.assertEqual(self.get_filters(out_path), self.get_filters(path))
+        with h5py.File(path, 'r') as f, h5py.File(out_path, 'r') as fout:
+            self.assertEqual(fout['data'].chunks, f['data'].chunks)
+            self.assertEqual(fout['data'].dtype, f['data'].dtype)
+        np.testing.assert_array_equal(self.read_data(out_path), self.frames)
+        
+    def test_writeto(self):
+        self.check_writeto(False)
+
+    @unittest.skipIf(hdf5plugin is None, 'hdf5plugin is not installed')
+    def test_writeto_blosc2(self):
+        self.check_writeto(True)
+
+
+class TestGetFrames(CubeTestCase):
+
+    def test_upcast(self):
+        path = self.get_path('frames.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        cube[:,:,:] = self.frames
+        cube.close()
+        
+        for upcast, dtype in ((True, np.float64), (False, np.float32)):
+            cube = orb.cube.HDFCube(path, instrument=INSTRUMENT, upcast=upcast)
+            frames = cube.get_frames([3, 1], x_slice=slice(10, 20))
+            cube.close()
+            self.assertEqual(frames.dtype, dtype)
+            np.testing.assert_array_equal(
+                frames, self.frames[10:20,:,[3, 1]])
+
+
+class TestResize(CubeTestCase):
+
+    def test_get_resized_data(self):
+        path = self.get_path('resize.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        cube[:,:,:] = self.frames
+        x = np.arange(self.shape[0])
+        y = np.arange(self.shape[1])
+        for size_x, size_y in ((300, 260), (700, 530)):
+            resized = cube.get_resized_data(size_x, size_y)
+            self.assertEqual(resized.shape, (size_x, size_y, self.shape[2]))
+            # former per-frame computation
+            x_new = np.linspace(0, self.shape[0], num=size_x)
+            y_new = np.linspace(0, self.shape[1], num=size_y)
+            for iframe in range(self.shape[2]):
+                expected = scipy.interpolate.RectBivariateSpline(
+                    x, y, self.frames[:,:,iframe].astype(float))(x_new, y_new)
+                np.testing.assert_allclose(
+                    resized[:,:,iframe], expected, rtol=0, atol=1e-10)
+        cube.close()
+
+
+class TestFrameHeaders(CubeTestCase):
+
+    def test_set_frame_header(self):
+        path = self.get_path('headers.hdf5')
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        for iframe in range(self.shape[2]):
+            header = astropy.io.fits.Header()
+            header['AIRMASS'] = 1. + iframe / 10.
+            cube.set_frame_header(iframe, header)
+        self.assertEqual(cube.get_frame_header(3)['AIRMASS'], 1.3)
+        np.testing.assert_array_equal(
+            cube.get_airmass(), 1. + np.arange(self.shape[2]) / 10.)
+        cube.close()
+        with h5py.File(path, 'r') as f:
+            self.assertEqual(f.attrs['format_version'], 2)
+            self.assertNotIn('frame_header_0', f)
+
+    def test_newer_format_version(self):
+        path = self.get_path('newer.hdf5')
+        orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT).close()
+        with h5py.File(path, 'r+') as f:
+            f.attrs['format_version'] = orb.cube.CUBE_FORMAT_VERSION + 1
+        with self.assertRaises(Exception):
+            orb.cube.HDFCube(path, instrument=INSTRUMENT)
+
+
+class TestMask(CubeTestCase):
+
+    def test_writeto(self):
+        path = self.get_path('mask.hdf5')
+        mask = np.random.default_rng(1).random(self.shape[:2]) > 0.2
+        cube = orb.cube.RWHDFCube(path, shape=self.shape, instrument=INSTRUMENT)
+        cube[:,:,:] = self.frames
+        cube.set_mask(mask)
+        out_path = self.get_path('out.hdf5')
+        cube.writeto(out_path)
+        cube.close()
+        
+        with h5py.File(out_path, 'r') as f:
+            self.assertEqual(f.attrs['format_version'], 3)
+            np.testing.assert_array_equal(
+                f['mask'].attrs['packed_shape'], self.shape[:2])
+        cube = orb.cube.HDFCube(out_path, instrument=INSTRUMENT, upcast=False)
+        np.testing.assert_array_equal(
+            cube[:,:,:], self.frames * mask[:,:,np.newaxis])
+        np.testing.assert_array_equal(
+            cube[10:20,30:301,4], self.frames[10:20,30:301,4] * mask[10:20,30:301])
+        cube.close()
+
+
+class TestOldCube(CubeTestCase):
+
+    def write_old_cube(self, path):
+        # level 1 cube: one dataset per frame
+        with h5py.File(path, 'w') as f:
+            f.attrs['dimx'], f.attrs['dimy'], f.attrs['dimz'] = self.shape
+            for iframe in range(self.shape[2]):
+                f['frame{:05d}/data'.format(iframe)] = self.frames[:,:,iframe]
+
+    def test_read(self):
+        path = self.get_path('old.hdf5')
+        self.write_old_cube(path)
+        cube = orb.cube.HDFCube(path, instrument=INSTRUMENT)
+        self.assertTrue(cube.is_level1())
+        np.testing.assert_array_equal(cube[:,:,2], self.frames[:,:,2])
+
+    def test_close(self):
+        path = self.get_path('old.hdf5')
+        self.write_old_cube(path)
+        cube = orb.cube.HDFCube(path, instrument=INSTRUMENT)
+        cube[:,:,2]
+        cube.close()
+        self.assertIsNone(cube.oldcube._hdf5f)
+        self.assertIsNone(cube.oldcube._mm)
+        # the file can be opened for writing
+        with h5py.File(path, 'r+') as f:
+            pass
+
+    def test_pickle(self):
+        path = self.get_path('old.hdf5')
+        self.write_old_cube(path)
+        cube = orb.old.HDFCube(path, silent_init=True, instrument=INSTRUMENT)
+        cube[:,:,2]
+        # objects are pickled with dill by orb.utils.parallel
+        cube_copy = dill.loads(dill.dumps(cube))
+        cube.close()
+        self.assertIsNone(cube_copy._hdf5f)
+        np.testing.assert_array_equal(cube_copy[:,:,3], self.frames[:,:,3])
+        cube_copy.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1112,11 +1112,15 @@ def nanbin_image(im, binning):
     if not im.ndim in [2, 3]: raise ValueError('Array dimensions must be 2 or 3')
     s0 = int(im.shape[0]//binning)
     s1 = int(im.shape[1]//binning)
-    im_view = np.copy(im[:s0 * binning, :s1 * binning, ...])
+    # no copy: the input is only read (reshape copies the data only
+    # if the image must be cropped)
+    im_view = im[:s0 * binning, :s1 * binning, ...]
     if im_view.size > 0:
-        im_view = im_view.reshape(int(im.shape[0]//binning), binning,
-                                  int(im.shape[1]//binning), binning,
-                                  -1)
+        im_view = im_view.reshape(s0, binning, s1, binning, -1)
+        # without NaNs the mean of the row means is the mean of each
+        # bin, computed in a single pass
+        if not np.isnan(np.sum(im_view)):
+            return np.squeeze(np.mean(im_view, axis=(1, 3)))
         return np.squeeze(np.nanmean(np.nanmean(im_view, axis=3), axis=1))
     else:
         return np.nanmean(im).reshape((1,1))
@@ -1817,19 +1821,22 @@ def get_quadrant_dims(quad_number, dimx, dimy, div_nb):
         raise Exception("quad_number out of bounds [0," + str(quad_nb- 1) + "]")
         return None
 
-    index_x = quad_number % div_nb
-    index_y = (quad_number - index_x) // div_nb
-    x_min = int(index_x * np.ceil(dimx // div_nb))
+    # the last quadrant along each axis takes the remaining pixels
+    index_y, index_x = divmod(int(quad_number), int(div_nb))
+    step_x = int(dimx) // int(div_nb)
+    step_y = int(dimy) // int(div_nb)
+    
+    x_min = index_x * step_x
     if (index_x != div_nb - 1):            
-        x_max = int((index_x  + 1) * np.ceil(dimx // div_nb))
+        x_max = (index_x  + 1) * step_x
     else:
-        x_max = dimx
+        x_max = int(dimx)
 
-    y_min = int(index_y * np.ceil(dimy // div_nb))
+    y_min = index_y * step_y
     if (index_y != div_nb - 1):            
-        y_max = int((index_y  + 1) * np.ceil(dimy // div_nb))
+        y_max = (index_y  + 1) * step_y
     else:
-        y_max = dimy
+        y_max = int(dimy)
 
     return x_min, x_max, y_min, y_max
 
@@ -22,6 +22,7 @@
 
 import logging
 import os
+import io
 import numpy as np
 import time
 import warnings
@@ -37,7 +38,7 @@ import datetime
 import orb.utils.validate
 
 
-def open_file(file_name, mode='r'):
+def open_file(file_name, mode='r', buffering=-1):
     """Open a file in write mode (by default) and return a file
     object.
 
@@ -48,6 +49,9 @@ def open_file(file_name, mode='r'):
 
     :param mode: (Optional) Can be 'w' for write mode, 'r' for
       read mode and 'a' for append mode.
+
+    :param buffering: (Optional) Buffer size in bytes, passed to
+      open(). If -1 the default buffer size is used (default -1).
     """
     if mode not in ['w','r','a']:
         raise Exception("mode option must be 'w', 'r' or 'a'")
@@ -59,9 +63,38 @@ def open_file(file_name, mode='r'):
             if not os.path.exists(dirname): 
                 os.makedirs(dirname)
 
-    return open(file_name, mode)
+    return open(file_name, mode, buffering=buffering)
+
+
+# HDUs smaller than this size (in bytes) are written to a memory
+# buffer first and then to the disk in a single write
+FITS_BUFFERED_WRITE_SIZE = 2**20
+
+def _write_hdu(hdu, path, overwrite):
+    """Write an HDU to a FITS file.
+
+    Small HDUs are serialized in memory and written in one call,
+    which avoids the many small writes of astropy (costly on
+    network file systems).
+
+    :param hdu: HDU to write.
 
+    :param path: Path to the FITS file.
 
+    :param overwrite: If True, an existing file is overwritten.
+    """
+    if hdu.data is None or hdu.data.nbytes >= FITS_BUFFERED_WRITE_SIZE:
+        hdu.writeto(path, overwrite=overwrite)
+        return
+
+    buf = io.BytesIO()
+    hdu.writeto(buf)
+    if overwrite: mode = 'wb'
+    else: mode = 'xb'
+    with open(path, mode) as f:
+        f.write(buf.getbuffer())
+
+    
 def write_fits(fits_path, fits_data, fits_header=None,
                silent=False, overwrite=True, mask=None,
                replace=False, record_stats=False, mask_path=None):
@@ -179,14 +212,10 @@ def write_fits(fits_path, fits_data, fits_header=None,
                 hdu = pyfits.PrimaryHDU(np.array([fits_data]))
 
             if mask is not None:
-                # mask conversion to only zeros or ones
-                mask = mask.astype(float)
-                mask[np.nonzero(np.isnan(mask))] = 1.
-                mask[np.nonzero(np.isinf(mask))] = 1.
-                mask[np.nonzero(mask)] = 1.
-                mask = mask.astype(np.uint8) # UINT8 is the
-                                             # smallest allowed
-                                             # type
+                # mask conversion to only zeros or ones (NaN and Inf
+                # are not equal to zero and are converted to ones)
+                mask = (np.asarray(mask, dtype=float) != 0).astype(
+                    np.uint8) # UINT8 is the smallest allowed type
                 hdu_mask = pyfits.PrimaryHDU(mask.transpose())
             # add header optional keywords
             if fits_header is not None:
@@ -222,10 +251,10 @@ def write_fits(fits_path, fits_data, fits_header=None,
             # add median and mean of the image in the header
             # data is nan filtered before
             if record_stats:
-                fdata = fits_data[np.nonzero(~np.isnan(fits_data))]
+                fdata = fits_data[~np.isnan(fits_data)]
                 if np.size(fdata) > 0:
-                    data_mean = np.nanmean(fdata)
-                    data_median = np.nanmedian(fdata)
+                    data_mean = np.mean(fdata)
+                    data_median = np.median(fdata)
                 else:
                     data_mean = np.nan
                     data_median = np.nan
@@ -245,7 +274,7 @@ def write_fits(fits_path, fits_data, fits_header=None,
                            after=5)
 
             # write FITS file
-            hdu.writeto(fits_path, overwrite=overwrite)
+            _write_hdu(hdu, fits_path, overwrite)
 
             if mask is not None:
                 hdu_mask.header = hdu.header
@@ -253,7 +282,7 @@ def write_fits(fits_path, fits_data, fits_header=None,
                 if mask_path is None:
                     mask_path = os.path.splitext(fits_path)[0] + '_mask.fits'
                     
-                hdu_mask.writeto(mask_path, overwrite=overwrite)
+                _write_hdu(hdu_mask, mask_path, overwrite)
 
             if not (silent):
                 logging.info("Data written as {} in {:.2f} s ".format(
@@ -541,7 +570,56 @@ def read_spiomm_data(hdu, image_path, substract_bias=True):
     return frame, hdr
 
 
-def open_hdf5(file_path, mode):
+# default size (in bytes) of the raw data chunk cache of the files
+# opened with large_cache=True. A larger cache can be set with the
+# rdcc_nbytes argument of open_hdf5.
+HDF5_CHUNK_CACHE_SIZE = 64 * 1024 * 1024
+
+# number of slots of the raw data chunk cache. Must be a prime number
+# much larger than the number of chunks fitting in the cache (chunks
+# of 3d cubes are 512 x 512 pixel tiles of one frame at most, i.e. 1
+# MB in float32, see get_cube_dataset_kwargs)
+HDF5_CHUNK_CACHE_NSLOTS = 10007
+
+_H5PY_FCLOSE_DEGREE = None # close degree of the files opened by h5py
+
+def _get_h5py_fclose_degree():
+    """Return the close degree of the files opened by h5py.File
+    (it depends on the h5py version).
+    """
+    global _H5PY_FCLOSE_DEGREE
+    if _H5PY_FCLOSE_DEGREE is None:
+        with h5py.File('fclose_degree', 'w', driver='core',
+                       backing_store=False) as f:
+            _H5PY_FCLOSE_DEGREE = f.id.get_access_plist().get_fclose_degree()
+    return _H5PY_FCLOSE_DEGREE
+
+def _make_fapl(rdcc_nbytes=None):
+    """Return a file access property list with enlarged metadata and
+    raw data chunk caches.
+
+    HDF5 default metadata cache (2 MB) is too small for cubes
+    containing thousands of datasets (one per frame).
+
+    :param rdcc_nbytes: (Optional) Size of the raw data chunk cache
+      in bytes. If None, HDF5_CHUNK_CACHE_SIZE is used (default None).
+    """
+    if rdcc_nbytes is None: rdcc_nbytes = HDF5_CHUNK_CACHE_SIZE
+    fapl = h5py.h5p.create(h5py.h5p.FILE_ACCESS)
+    # HDF5 refuses to open a file already opened with another close
+    # degree: use the one of the files opened by h5py
+    fapl.set_fclose_degree(_get_h5py_fclose_degree())
+    config = fapl.get_mdc_config()
+    config.set_initial_size = True
+    config.initial_size = 128 * 1024 * 1024
+    config.max_size = 128 * 1024 * 1024
+    config.min_size = 64 * 1024 * 1024
+    fapl.set_mdc_config(config)
+    # raw data chunk cache: nslots must be a prime number
+    fapl.set_cache(0, HDF5_CHUNK_CACHE_NSLOTS, int(rdcc_nbytes), 0.75)
+    return fapl
+
+def open_hdf5(file_path, mode, large_cache=False, rdcc_nbytes=None):
     """Return a :py:class:`h5py.File` instance with some
     informations.
 
@@ -550,6 +628,15 @@ def open_hdf5(file_path, mode):
     :param mode: Opening mode. Can be 'r', 'r+', 'w', 'w-', 'x',
       'a'.
 
+    :param large_cache: (Optional) If True, the file is opened with
+      enlarged metadata and chunk caches. The metadata cache is only
+      enlarged when an existing file is opened ('r' or 'r+' mode)
+      (default False).
+
+    :param rdcc_nbytes: (Optional) Size of the raw data chunk cache
+      in bytes when large_cache is True. If None,
+      HDF5_CHUNK_CACHE_SIZE is used (default None).
+
     .. note:: Please refer to http://www.h5py.org/.
     """
     if mode in ['w', 'a', 'w-', 'x']:
@@ -559,7 +646,18 @@ def open_hdf5(file_path, mode):
             if not os.path.exists(dirname): 
                 os.makedirs(dirname)
 
-    f = h5py.File(file_path, mode)
+    if large_cache and mode in ['r', 'r+']:
+        if mode == 'r': flags = h5py.h5f.ACC_RDONLY
+        else: flags = h5py.h5f.ACC_RDWR
+        f = h5py.File(h5py.h5f.open(
+            os.fsencode(file_path), flags, fapl=_make_fapl(
+                rdcc_nbytes=rdcc_nbytes)))
+    elif large_cache:
+        if rdcc_nbytes is None: rdcc_nbytes = HDF5_CHUNK_CACHE_SIZE
+        f = h5py.File(file_path, mode, rdcc_nbytes=int(rdcc_nbytes),
+                      rdcc_nslots=HDF5_CHUNK_CACHE_NSLOTS, rdcc_w0=0.75)
+    else:
+        f = h5py.File(file_path, mode)
 
     if mode in ['w', 'a', 'w-', 'x', 'r+']:
         f.attrs['program'] = 'Created/modified with ORB'
@@ -567,6 +665,47 @@ def open_hdf5(file_path, mode):
 
     return f
 
+def read_hdf5_dataset(dset):
+    """Read a whole HDF5 dataset into a new numpy array.
+
+    Numerical datasets are read directly into a preallocated array,
+    which avoids the overhead of the h5py slicing machinery.
+
+    :param dset: An h5py.Dataset instance.
+    """
+    if (dset.shape is None or len(dset.shape) == 0 or dset.size == 0
+        or dset.dtype.kind not in 'biufc'):
+        return dset[()]
+    
+    arr = np.empty(dset.shape, dtype=dset.dtype)
+    dset.read_direct(arr)
+    return arr
+
+def read_hdf5_attrs(obj):
+    """Read all the attributes of an HDF5 object into a dict.
+
+    Attributes are read in one pass. If one of them cannot be read,
+    they are read one by one and the unreadable ones are skipped.
+    Bytes values are decoded.
+
+    :param obj: An h5py.File, h5py.Group or h5py.Dataset instance.
+    """
+    try:
+        attrs = dict(obj.attrs.items())
+    except TypeError:
+        attrs = dict()
+        for iattr in obj.attrs:
+            try:
+                attrs[iattr] = obj.attrs[iattr]
+            except TypeError as e:
+                logging.debug('error reading param from attributes {}: {}'.format(
+                    iattr, e))
+                
+    for iattr, ivalue in attrs.items():
+        if isinstance(ivalue, bytes):
+            attrs[iattr] = ivalue.decode()
+    return attrs
+
 def write_hdf5(file_path, data, header=None,
                silent=False, overwrite=True, max_hdu_check=True,
                compress=False):
@@ -820,13 +959,13 @@ def header_fits2hdf5(fits_header):
     """
     hdf5_header = list()
 
+    keys = list(fits_header.keys())
     for ikey in range(len(fits_header)):
         _tstr = str(type(fits_header[ikey]))
-        ival = np.array(
-            (list(fits_header.keys())[ikey], str(fits_header[ikey]),
+        hdf5_header.append(
+            (keys[ikey], str(fits_header[ikey]),
              fits_header.comments[ikey], _tstr))
-
-        hdf5_header.append(ival)
+        
     return np.array(hdf5_header, dtype='S300')
 
 
@@ -835,15 +974,15 @@ def header_hdf52fits(hdf5_header):
 
     :param hdf5_header: Header of the HDF5 file
     """
-    fits_header = pyfits.Header()
-    for i in range(hdf5_header.shape[0]):
-        ival = hdf5_header[i,:]
-        ival = [iival.decode() for iival in ival]
-        if ival[3] != 'comment':
-            fits_header[ival[0]] = cast(ival[1], ival[3]), str(ival[2])
+    # all the rows are decoded at once and the header is created
+    # from the list of its cards
+    cards = list()
+    for ikey, ival, icomment, itype in np.char.decode(np.asarray(hdf5_header)):
+        if itype != 'comment':
+            cards.append((ikey, cast(ival, itype), icomment))
         else:
-            fits_header['comment'] = ival[1]
-    return fits_header
+            cards.append(('COMMENT', ival))
+    return pyfits.Header(cards)
 
 def read_hdf5(file_path, return_header=False, dtype=float):
 
@@ -912,6 +1051,59 @@ def cast_storing_dtype(arr):
         raise TypeError('arr must be a numpy.ndarray instance')
     return arr.astype(get_storing_dtype(arr))
 
+def get_cube_dataset_kwargs(shape, compress=False):
+    """Return the keyword arguments passed to
+    :py:meth:`h5py.Group.create_dataset` to create the 3d data
+    dataset of a cube.
+
+    Chunks are aligned on frames (a chunk is at most a 512x512 tile
+    of a frame) so that a frame can be written or read without
+    touching the chunks of the other frames.
+
+    :param shape: Shape of the cube.
+
+    :param compress: (Optional) If True, data is compressed with
+      Blosc2 (zstd). Requires hdf5plugin, which must also be
+      installed to read the cube (default False).
+    """
+    orb.utils.validate.has_len(shape, 3, object_name='shape')
+    kwargs = dict()
+    kwargs['chunks'] = (min(shape[0], 512), min(shape[1], 512), 1)
+    if compress:
+        try:
+            import hdf5plugin
+        except ImportError:
+            logging.warning('hdf5plugin is not installed, data will not be compressed')
+        else:
+            kwargs.update(hdf5plugin.Blosc2(
+                cname='zstd', clevel=3, filters=hdf5plugin.Blosc2.SHUFFLE))
+    return kwargs
+
+
+def get_data_dataset_kwargs(shape, compress=False):
+    """Return the keyword arguments passed to
+    :py:meth:`h5py.Group.create_dataset` to create a dataset of a
+    :py:class:`orb.core.Data` instance.
+
+    3d data is chunked by 64x64 tiles of pixels keeping their whole
+    spectrum contiguous. Other data is only chunked when compressed.
+
+    :param shape: Shape of the dataset.
+
+    :param compress: (Optional) If True, data is shuffled and
+      compressed with LZF, which is shipped with h5py (default
+      False).
+    """
+    kwargs = dict()
+    if len(shape) == 3:
+        kwargs['chunks'] = (min(shape[0], 64), min(shape[1], 64), shape[2])
+    if compress and np.prod(shape) > 0:
+        kwargs['compression'] = 'lzf'
+        kwargs['shuffle'] = True
+        if 'chunks' not in kwargs:
+            kwargs['chunks'] = True
+    return kwargs
+
 
 def save_dflist(dflist, path):
     """Save a list of dataframes
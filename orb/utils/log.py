@@ -20,13 +20,63 @@
 ## You should have received a copy of the GNU General Public License
 ## along with ORB.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import logging.handlers
+import struct
+import socket
+
+try: import msgpack
+except ImportError: msgpack = None
+
+
+class NoDelaySocketHandler(logging.handlers.SocketHandler):
+    """Socket handler sending each log record without waiting for
+    more data to fill a TCP segment (Nagle's algorithm disabled).
+    """
+    def makeSocket(self, timeout=1):
+        """Create the socket and disable Nagle's algorithm.
+
+        :param timeout: (Optional) Connection timeout (default 1).
+        """
+        s = super().makeSocket(timeout=timeout)
+        if s.family in (socket.AF_INET, socket.AF_INET6):
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return s
+
+    
+class MsgpackSocketHandler(NoDelaySocketHandler):
+    """Socket handler sending log records packed with msgpack instead
+    of pickle. Records are received by
+    :py:class:`orb.core.LogRecordStreamHandler`.
+    """
+    def makePickle(self, record):
+        """Pack the record in binary format, prefixed with its length.
+
+        :param record: A LogRecord instance.
+        """
+        if record.exc_info:
+            # exc_text is set by format
+            self.format(record)
+        d = dict(record.__dict__)
+        # message is formatted before to remove non serializable
+        # arguments
+        d['msg'] = record.getMessage()
+        d['args'] = None
+        d['exc_info'] = None
+        d.pop('message', None)
+        s = msgpack.packb(d, use_bin_type=True, default=str)
+        return struct.pack('>L', len(s)) + s
+
     
 def setup_socket_logging():
-    import logging
-    import logging.handlers
     rootLogger = logging.getLogger()
     rootLogger.setLevel(logging.DEBUG)
-    socketHandler = logging.handlers.SocketHandler(
+    # msgpack is faster than pickle and safe to deserialize
+    if msgpack is not None:
+        handler_class = MsgpackSocketHandler
+    else:
+        handler_class = NoDelaySocketHandler
+    socketHandler = handler_class(
         'localhost',logging.handlers.DEFAULT_TCP_LOGGING_PORT)
     rootLogger.addHandler(socketHandler)
 
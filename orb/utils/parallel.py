@@ -24,6 +24,8 @@ import logging
 import os
 import getpass
 import multiprocessing
+import concurrent.futures
+import collections
 import dill
 import warnings
 import traceback
@@ -161,6 +163,42 @@ def get_ncpus(ncpus):
         logging.debug('max cpus limited to {} because of machine hard limit configuration'.format(max_cpus))
     return ncpus
 
+
+def imap_threads(func, iterable, ncpus=0, max_pending=None):
+    """Apply a function to each element of an iterable in a pool of
+    threads and yield the results in order.
+
+    Elements are taken from the iterable (in the calling thread) only
+    when less than max_pending of them are being processed. This can
+    be used to read the frames of a cube only when they are needed
+    while the previous ones are processed.
+
+    :param func: Function taking one element as argument.
+
+    :param iterable: Iterable of elements.
+
+    :param ncpus: (Optional) Number of threads. 0 means use all
+      available cpus (default 0).
+
+    :param max_pending: (Optional) Maximum number of elements being
+      processed. If None, it is set to twice the number of threads
+      (default None).
+
+    .. note:: Only useful if func releases the GIL (e.g. numpy or
+      scipy.ndimage functions working on large arrays).
+    """
+    ncpus = int(ncpus)
+    if ncpus <= 0: ncpus = multiprocessing.cpu_count()
+    if max_pending is None: max_pending = 2 * ncpus
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ncpus) as pool:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
     
     
 def init_pp_server(ncpus=0, silent=False, use_ray=False, timeout=1000):
@@ -51,8 +51,9 @@ def create_nm_axis(n, step, order, corr=1.):
     else:
         raise Exception("order must be > 0")
     
-def create_cm1_axis(n, step, order, corr=1.):
-    """Create a regular wavenumber axis in cm-1.
+def get_cm1_axis_bounds(n, step, order, corr=1.):
+    """Return the first and last values of a regular wavenumber axis
+    in cm-1 without creating the axis.
 
     :param n: Number of steps on the axis
     
@@ -61,11 +62,27 @@ def create_cm1_axis(n, step, order, corr=1.):
     :param order: Folding order
     
     :param corr: (Optional) Coefficient of correction (default 1.)
+
+    :return: (cm1_min, cm1_max)
     """
     cm1_min = orb.cutils.get_cm1_axis_min(int(n), float(step),
                                           int(order), corr=float(corr))
     cm1_max = orb.cutils.get_cm1_axis_max(int(n), float(step),
                                           int(order), corr=float(corr))
+    return cm1_min, cm1_max
+
+def create_cm1_axis(n, step, order, corr=1.):
+    """Create a regular wavenumber axis in cm-1.
+
+    :param n: Number of steps on the axis
+    
+    :param step: Step size in nm
+    
+    :param order: Folding order
+    
+    :param corr: (Optional) Coefficient of correction (default 1.)
+    """
+    cm1_min, cm1_max = get_cm1_axis_bounds(n, step, order, corr=corr)
     return np.linspace(cm1_min, cm1_max, n, dtype=np.longdouble) 
     
     